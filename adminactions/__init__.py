@@ -3,6 +3,8 @@ NAME = 'django-adminactions'
 VERSION = __version__ = (0, 8, 5, 'final', 0)
 __author__ = 'sax'
 
+default_app_config = 'adminactions.apps.Config'
+
 import subprocess
 import datetime
 import os
@@ -4,13 +4,17 @@ from .merge import merge
 from .mass_update import mass_update
 from .export import export_as_fixture, export_as_csv, export_delete_tree, export_as_xls
 from .graph import graph_queryset
+from .duplicates import find_duplicates
+from .bulk_delete import bulk_delete
 
 actions = [export_as_fixture,
            export_as_csv,
            export_as_xls,
            export_delete_tree,
            merge, mass_update,
-           graph_queryset]
+           graph_queryset,
+           find_duplicates,
+           bulk_delete]
 
 
 def add_to_site(site, exclude=None):
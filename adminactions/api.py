@@ -1,15 +1,23 @@
 # -*- encoding: utf-8 -*-
 from __future__ import absolute_import, unicode_literals
 import collections
+import functools
 import itertools
+import operator
+import tempfile
 import six
 import pytz
 import xlwt
 import datetime
+from wsgiref.util import FileWrapper
 from django.conf import settings
-from django.core.exceptions import ObjectDoesNotExist
+from django.db import connections, router
+from django.db.models import (CASCADE, BooleanField, Count, DateField, NullBooleanField, Q,
+                              TimeField)
+from django.db.models.deletion import Collector
 from django.db.models.fields import FieldDoesNotExist
-from django.db.models.fields.related import ManyToManyField, OneToOneField
+from django.db.models.fields.related import ForeignKey, ManyToManyField, OneToOneField
+from django.db.models.query import QuerySet
 from django.http import HttpResponse
 try:
     # actually supported in admin actions since django >= 1.6
@@ -27,8 +35,8 @@ except ImportError:
 from django.utils import dateformat
 from django.utils.encoding import smart_str, force_text, smart_text
 from adminactions import compat
-from adminactions.templatetags.actions import get_field_value
-from adminactions.utils import (clone_instance, get_field_by_path)
+from adminactions.utils import (clone_instance, get_field_by_path, get_field_accessors, iter_queryset,
+                               normalize, prefix, soundex)
 
 if six.PY2:
     import unicodecsv as csv
@@ -65,8 +73,35 @@ def merge(master, other, fields=None, commit=False, m2m=None, related=None):  #
     @param related: list of related fieldnames to merge. If empty will be removed
     @return:
     """
+    return merge_many(master, [other], fields=fields, commit=commit, m2m=m2m, related=related)
+
+
+def merge_many(master, others, fields=None, commit=False, m2m=None, related=None):  # noqa
+    """
+        Merge all the records in 'others' into master, in a single transaction.
+
+        `fields` is a list of fieldnames that must be readed from the first of ``others``
+        to put into master: the values of the other records are never used.
+        If ``fields`` is None ``master`` will get all the values of the first of ``others``
+        except primary_key.
+        Dependencies of all ``others`` are moved with one statement for each relation.
+        Finally ``others`` will be deleted and master will be preserved
+
+        Raises ValueError if more than one of ``master`` and ``others`` has a record related
+        by a OneToOneField (or unique ForeignKey) that should be moved: only one of them can
+        point to master.
+
+    @param master:  Model instance
+    @param others: list of Model instances
+    @param fields: list of fieldnames to  merge
+    @param m2m: list of m2m fields to merge. If empty will be removed
+    @param related: list of related fieldnames to merge. If empty will be removed
+    @return:
+    """
 
     fields = fields or [f.name for f in master._meta.fields]
+    others = [other for other in others if other.pk != master.pk]
+    other_pks = [other.pk for other in others]
 
     all_m2m = {}
     all_related = {}
@@ -82,52 +117,378 @@ def merge(master, other, fields=None, commit=False, m2m=None, related=None):  #
         raise ValueError('Cannot save related with `commit=False`')
     with compat.atomic():
         result = clone_instance(master)
+        if not others:
+            return result
 
         for fieldname in fields:
             f = get_field_by_path(master, fieldname)
             if f and not f.primary_key:
-                setattr(result, fieldname, getattr(other, fieldname))
+                setattr(result, fieldname, getattr(others[0], fieldname))
 
         if m2m:
             for fieldname in set(m2m):
-                all_m2m[fieldname] = []
                 field_object = get_field_by_path(master, fieldname)
                 if not isinstance(field_object, ManyToManyField):
                     raise ValueError('{0} is not a ManyToManyField field'.format(fieldname))
-                source_m2m = getattr(other, field_object.name)
-                for r in source_m2m.all():
-                    all_m2m[fieldname].append(r)
+                lookup = '%s__in' % field_object.related_query_name()
+                targets = field_object.rel.to._base_manager.filter(**{lookup: other_pks})
+                all_m2m[fieldname] = list(targets.values_list('pk', flat=True).distinct())
         if related:
             for name in set(related):
                 related_object = get_field_by_path(master, name)
-                all_related[name] = []
                 if related_object and isinstance(related_object.field, OneToOneField):
-                    try:
-                        accessor = getattr(other, name)
-                        all_related[name] = [(related_object.field.name, accessor)]
-                    except ObjectDoesNotExist:
-                        pass
+                    all_related[name] = (related_object.field.model, related_object.field.name)
                 else:
-                    accessor = getattr(other, name)
+                    accessor = getattr(master, name)
                     rel_fieldname = list(accessor.core_filters.keys())[0].split('__')[0]
-                    for r in accessor.all():
-                        all_related[name].append((rel_fieldname, r))
+                    all_related[name] = (accessor.model, rel_fieldname)
 
         if commit:
-            for name, elements in list(all_related.items()):
-                for rel_fieldname, element in elements:
-                    setattr(element, rel_fieldname, master)
-                    element.save()
-
-            other.delete()
+            for name, (rel_model, rel_fieldname) in list(all_related.items()):
+                if rel_model._meta.get_field(rel_fieldname).unique:
+                    pointing = rel_model._base_manager.filter(**{'%s__in' % rel_fieldname: other_pks + [master.pk]})
+                    if pointing.count() > 1:
+                        raise ValueError("Cannot merge: {0} records of {1} point to the merged records "
+                                         "but '{2}' accepts only one".format(pointing.count(),
+                                                                            rel_model._meta.object_name,
+                                                                            rel_fieldname))
+
+            # one UPDATE for each relation, no matter how many records point to `others`
+            for name, (rel_model, rel_fieldname) in list(all_related.items()):
+                rel_model._base_manager.filter(**{'%s__in' % rel_fieldname: others}) \
+                    .update(**{rel_fieldname: master})
+
+            for other in others:
+                # dependencies are already moved: delete() finds only what must be removed
+                other.delete()
             result.save()
             for fieldname, elements in list(all_m2m.items()):
-                dest_m2m = getattr(result, fieldname)
-                for element in elements:
-                    dest_m2m.add(element)
+                if elements:
+                    getattr(result, fieldname).add(*elements)
     return result
 
 
+BLOCKING_KEYS = collections.OrderedDict([
+    ('exact', (None, "same value")),
+    ('normalized', (normalize, "same value ignoring case, accents and punctuation")),
+    ('prefix', (prefix, "same first 4 letters")),
+    ('soundex', (soundex, "same pronunciation (soundex)"))])
+
+
+def _get_duplicated_values(queryset, fields, min_size):
+    # exact matches are grouped by the database
+    rows = queryset.values(*fields).annotate(adminactions_count=Count('pk')) \
+        .filter(adminactions_count__gte=min_size).order_by()
+    return set(tuple(row[f] for f in fields) for row in rows)
+
+
+def find_duplicates(queryset, fields, key='normalized', min_size=2, chunk_size=None):
+    """
+    returns the clusters of records of `queryset` that share the same blocking key.
+
+    :param queryset: queryset to analyze
+    :param fields: list of field names used to compute the key
+    :param key: name of one of `BLOCKING_KEYS` or callable that accept a value and returns its key
+    :param min_size: minimum number of records of a cluster
+    :param chunk_size: see :func:`adminactions.utils.iter_queryset`
+    :return: list of lists of primary keys, the biggest clusters first
+    """
+    fields = list(fields)
+    func = BLOCKING_KEYS[key][0] if not callable(key) else key
+    selected = None
+    if func is None:
+        selected = _get_duplicated_values(queryset, fields, min_size)
+        if not selected:
+            return []
+
+    index = collections.defaultdict(list)
+    for row in iter_queryset(queryset.values_list('pk', *fields).order_by(), chunk_size):
+        values = row[1:]
+        if selected is not None:
+            if values not in selected:
+                continue
+            block = values
+        else:
+            block = tuple(func(value) if value is not None else '' for value in values)
+        if all(value is None or value == '' for value in values):
+            # never group empty values
+            continue
+        index[block].append(row[0])
+
+    clusters = [pks for pks in index.values() if len(pks) >= min_size]
+    clusters.sort(key=len, reverse=True)
+    return clusters
+
+
+class DeleteSummary(list):
+    """
+    list of (model, count) tuples returned by :func:`get_delete_summary`.
+    `truncated` is True when some records are not counted because they are
+    more than `max_depth` relations away
+    """
+    truncated = False
+
+
+_INTEGER_FIELDS = ('AutoField', 'BigIntegerField', 'IntegerField', 'PositiveIntegerField',
+                   'PositiveSmallIntegerField', 'SmallIntegerField')
+
+
+def _get_cascade(model, qs):
+    """
+    returns a list of (model, Q) that select the records deleted in cascade
+    with the records of `qs`
+    """
+    opts = model._meta
+    db = qs.db
+    related = [(parent, Q(pk__in=qs.values(ptr.attname))) for parent, ptr in opts.parents.items() if ptr]
+    for rel in opts.get_all_related_objects(include_hidden=True, include_proxy_eq=True):
+        field = rel.field
+        if field.rel.on_delete is CASCADE:
+            related.append((field.model, Q(**{'%s__in' % field.name: qs.values(field.rel.field_name)})))
+    for field in opts.virtual_fields:
+        if hasattr(field, 'bulk_related_objects'):
+            # GenericRelation, see django.db.models.deletion.Collector.collect()
+            related_opts = field.rel.to._meta
+            object_id = related_opts.get_field(field.object_id_field_name)
+            content_type = related_opts.get_field(field.content_type_field_name).rel.to
+            content_type = content_type.objects.db_manager(db).get_for_model(
+                field.model, for_concrete_model=field.for_concrete_model)
+            types = set([object_id.get_internal_type(), opts.pk.get_internal_type()])
+            if len(types) == 1 or types.issubset(_INTEGER_FIELDS):
+                pks = qs.values('pk')
+            else:
+                # the database cannot compare the columns (ie. text object_id and integer pk)
+                pks = list(qs.values_list('pk', flat=True))
+            related.append((field.rel.to, Q(**{field.content_type_field_name: content_type.pk,
+                                               '%s__in' % field.object_id_field_name: pks})))
+    return related
+
+
+def get_delete_summary(queryset, max_depth=10):
+    """
+    returns how many records of each model would be deleted by `queryset.delete()`,
+    without loading them.
+
+    Relations are walked following the ON DELETE CASCADE ForeignKeys, the GenericRelations
+    and the parents of multi-table inherited models; the records of each model reached at
+    the same level are selected with one query, filtering by subqueries of the previous level,
+    and counted with one query for each model.
+    Relations that do not select any record are not walked further.
+
+    :param queryset: queryset to delete
+    :param max_depth: maximum number of relations walked from `queryset`
+    :return: :class:`DeleteSummary`
+    """
+    db = queryset.db
+    found = collections.OrderedDict()
+    level = [(queryset.model._meta.concrete_model, queryset)]
+    summary = DeleteSummary()
+    for depth in range(max_depth + 1):
+        conditions = collections.OrderedDict()
+        for model, qs in level:
+            found.setdefault(model, []).append(qs)
+            for rel_model, condition in _get_cascade(model, qs):
+                conditions.setdefault(rel_model._meta.concrete_model, []).append(condition)
+        level = []
+        for model, model_conditions in conditions.items():
+            qs = model._base_manager.using(db).filter(functools.reduce(operator.or_, model_conditions))
+            if qs.exists():
+                level.append((model, qs))
+        if not level:
+            break
+        if depth == max_depth:
+            summary.truncated = True
+
+    for model, querysets in found.items():
+        condition = functools.reduce(operator.or_, [Q(pk__in=qs.values('pk')) for qs in querysets])
+        summary.append((model, model._base_manager.using(db).filter(condition).count()))
+    return summary
+
+
+def get_delete_chunk_size():
+    """
+    returns the number of records deleted in each transaction by :func:`bulk_delete`:
+    ``settings.ADMINACTIONS_DELETE_CHUNK_SIZE`` (default: 1000)
+    """
+    return getattr(settings, 'ADMINACTIONS_DELETE_CHUNK_SIZE', 1000)
+
+
+def bulk_delete(queryset, chunk_size=None, progress=None):
+    """
+    deletes the records of `queryset` and their cascade, `chunk_size` records at time
+    in primary key order, each chunk in its own transaction.
+
+    Each chunk is deleted by :class:`django.db.models.deletion.Collector`, so related
+    records without signals or further cascades are deleted with a single
+    ``DELETE`` statement, without loading them.
+    If a chunk cannot be deleted (ie. ProtectedError) the exception is raised:
+    the chunks already deleted are not restored.
+
+    :param queryset: queryset to delete
+    :param chunk_size: number of records of `queryset` deleted in each transaction.
+                       Default :func:`get_delete_chunk_size`
+    :param progress: callable called after each chunk with the number of records deleted so far
+    :return: number of records of `queryset` deleted
+    """
+    chunk_size = chunk_size or get_delete_chunk_size()
+    model = queryset.model
+    db = queryset._db or router.db_for_write(model)
+    pks = queryset.using(db).order_by('pk').values_list('pk', flat=True)
+    deleted = 0
+    last = None
+    while True:
+        chunk = list((pks if last is None else pks.filter(pk__gt=last))[:chunk_size])
+        if not chunk:
+            break
+        with compat.atomic(using=db):
+            collector = Collector(using=db)
+            collector.collect(model._base_manager.using(db).filter(pk__in=chunk))
+            collector.delete()
+        deleted += len(chunk)
+        last = chunk[-1]
+        if progress:
+            progress(deleted)
+    return deleted
+
+
+def _get_values_list_lookups(queryset, fields, usedisplay=True):
+    """
+    returns the ORM lookups needed to read ``fields`` using ``queryset.values_list()``
+    or None if at least one of them needs a real model instance (callables, properties,
+    relations rendered as text, choices rendered with get_FOO_display()...)
+    """
+    if not isinstance(queryset, QuerySet) or getattr(queryset, '_fields', None) is not None:
+        # not a queryset or already a values()/values_list() one
+        return None
+    if queryset.query.distinct:
+        return None
+    lookups = []
+    for fieldname in fields:
+        model = queryset.model
+        parts = fieldname.split('.')
+        for i, part in enumerate(parts):
+            try:
+                field, __, direct, m2m = model._meta.get_field_by_name(part)
+            except FieldDoesNotExist:
+                return None
+            if not direct or m2m or not getattr(field, 'column', None):
+                return None
+            is_last = i == len(parts) - 1
+            if getattr(field, 'rel', None):
+                if is_last:
+                    return None
+                model = field.rel.to
+            elif not is_last:
+                return None
+        if usedisplay and (field.choices or hasattr(model, 'get_%s_display' % field.name)):
+            # rendered by get_FOO_display(), also when defined without choices
+            return None
+        lookups.append('__'.join(parts))
+    return lookups
+
+
+def _get_related_lookups(model, fields):
+    """
+    returns the ``select_related()`` lookups needed to read ``fields`` from ``model``
+    instances without extra queries. ie. ``['user.profile.company.name']`` needs
+    ``['user__profile__company']``
+    """
+    lookups = []
+    for fieldname in fields:
+        target = model
+        path = []
+        for part in fieldname.split('.'):
+            try:
+                field, __, direct, m2m = target._meta.get_field_by_name(part)
+            except FieldDoesNotExist:
+                break
+            if not (direct and isinstance(field, ForeignKey)):
+                break
+            path.append(part)
+            target = field.rel.to
+        if path:
+            lookup = '__'.join(path)
+            if lookup not in lookups:
+                lookups.append(lookup)
+    return lookups
+
+
+def _select_related(queryset, fields):
+    """
+    add to ``queryset`` the ``select_related()`` needed by ``fields``
+    (one joined query instead of one query for each relation for each row)
+    """
+    if not isinstance(queryset, QuerySet) or getattr(queryset, '_fields', None) is not None:
+        return queryset
+    if queryset.query.select_related is True:
+        # select_related() without arguments already follows all the non-null ForeignKeys
+        return queryset
+    lookups = _get_related_lookups(queryset.model, fields)
+    if lookups:
+        queryset = queryset.select_related(*lookups)
+    return queryset
+
+
+def _track_progress(rows, progress, every):
+    """
+    yields ``rows`` calling ``progress(processed)`` every ``every`` rows
+    """
+    processed = 0
+    for row in rows:
+        yield row
+        processed += 1
+        if processed % every == 0:
+            progress(processed)
+
+
+def _get_rows(queryset, fields, usedisplay=True, raw_callable=False, chunk_size=None, progress=None,
+              fetch_size=None):
+    """
+    returns the rows to export and a callable that, given a row, returns the
+    list of the field accessors to use for it.
+    If all the ``fields`` are concrete columns (or paths to them) the rows are
+    fetched as tuples with ``values_list()``, without creating any model instance,
+    otherwise the ForeignKeys used by ``fields`` are added to ``select_related()``.
+    Rows are never cached, see :func:`adminactions.utils.iter_queryset`; with ``fetch_size``
+    they are read using a server-side cursor, where available.
+    If ``progress`` is provided it is called with the number of processed rows
+    every ``chunk_size`` (or 1000) rows.
+    """
+    lookups = _get_values_list_lookups(queryset, fields, usedisplay)
+    if lookups is None:
+        rows = iter_queryset(_select_related(queryset, fields), chunk_size, fetch_size)
+        get_accessors = lambda row: get_field_accessors(row, fields, usedisplay, raw_callable)
+    else:
+        accessors = [operator.itemgetter(i) for i in range(len(lookups))]
+        rows = iter_queryset(queryset.values_list(*lookups), chunk_size, fetch_size)
+        get_accessors = lambda row: accessors
+    if progress:
+        rows = _track_progress(rows, progress, chunk_size or 1000)
+    return rows, get_accessors
+
+
+def get_export_chunk_size(config=None):
+    """
+    returns the number of records to fetch for each query during an export:
+    ``config['chunk_size']`` if present, otherwise ``settings.ADMINACTIONS_EXPORT_CHUNK_SIZE``.
+    None means 'all at once' using ``QuerySet.iterator()``
+    """
+    if config and config.get('chunk_size'):
+        return int(config['chunk_size'])
+    return getattr(settings, 'ADMINACTIONS_EXPORT_CHUNK_SIZE', None)
+
+
+def get_export_fetch_size(config=None):
+    """
+    returns the number of rows read for each round trip using a server-side cursor
+    during an export: ``config['fetch_size']`` if present, otherwise
+    ``settings.ADMINACTIONS_EXPORT_FETCH_SIZE``. None means 'do not use server-side cursors'
+    """
+    if config and config.get('fetch_size'):
+        return int(config['fetch_size'])
+    return getattr(settings, 'ADMINACTIONS_EXPORT_FETCH_SIZE', None)
+
+
 class Echo(object):
     """An object that implements just the write method of the file-like
     interface.
@@ -137,6 +498,66 @@ class Echo(object):
         return value
 
 
+def get_csv_engine(config=None):
+    """
+    returns the engine used by :func:`export_as_csv`: ``config['engine']`` if present,
+    otherwise ``settings.ADMINACTIONS_CSV_ENGINE`` (default: 'python')
+    """
+    if config and config.get('engine'):
+        return config['engine']
+    return getattr(settings, 'ADMINACTIONS_CSV_ENGINE', 'python')
+
+
+def _get_copy_sql(queryset, fields, config):
+    """
+    returns the ``COPY (query) TO STDOUT WITH CSV`` statement that exports ``fields``
+    of ``queryset`` as :func:`export_as_csv` would do or None if the database
+    cannot produce the same result (not PostgreSQL, columns that need a model instance
+    or formatted by the export options, csv options not supported by COPY)
+    """
+    connection = connections[queryset.db]
+    if connection.vendor != 'postgresql' or config.get('dialect') is not None:
+        return None
+    if config.get('escapechar'):
+        # python escapes the escapechar itself (python >= 3.10), COPY does not
+        return None
+    quoting = int(config['quoting'])
+    if quoting not in (csv.QUOTE_ALL, csv.QUOTE_MINIMAL):
+        return None
+    lookups = _get_values_list_lookups(queryset, fields)
+    if lookups is None:
+        return None
+    for lookup in lookups:
+        field = get_field_by_path(queryset.model, lookup.replace('__', '.'))
+        if isinstance(field, (DateField, TimeField, BooleanField, NullBooleanField)):
+            # formatted using date_format, datetime_format, time_format or as python does
+            return None
+
+    def literal(value):
+        return "'%s'" % smart_text(value).replace("'", "''")
+
+    options = ['FORMAT csv',
+               'DELIMITER %s' % literal(config['delimiter']),
+               'QUOTE %s' % literal(config['quotechar'])]
+    if quoting == csv.QUOTE_ALL:
+        options.append('FORCE_QUOTE *')
+    sql, params = queryset.values_list(*lookups).query.sql_with_params()
+    with connection.cursor() as cursor:
+        # COPY does not accept parameters
+        sql = smart_text(cursor.cursor.mogrify(sql, params))
+    return 'COPY (%s) TO STDOUT WITH (%s)' % (sql, ', '.join(options))
+
+
+def _copy_to(using, sql, out):
+    """
+    executes the COPY statement ``sql`` writing into ``out``.
+    Returns the number of rows copied (-1 if the driver does not report it)
+    """
+    with connections[using].cursor() as cursor:
+        cursor.cursor.copy_expert(sql, out)
+        return cursor.cursor.rowcount
+
+
 def export_as_csv(queryset, fields=None, header=None,  # noqa
                   filename=None, options=None, out=None):
     """
@@ -150,8 +571,15 @@ def export_as_csv(queryset, fields=None, header=None,  # noqa
     :param: out: object that implements File protocol. HttpResponse if None.
 
     :return: HttpResponse instance
+
+    If ``options['engine']`` (or ``settings.ADMINACTIONS_CSV_ENGINE``) is 'copy' and
+    the database is PostgreSQL, the rows are produced by ``COPY (query) TO STDOUT``
+    when all the columns are plain database values (see :func:`_get_copy_sql`).
+    COPY writes the whole export before the response is returned: with ``ADMINACTIONS_STREAM_CSV``
+    it is written into a temporary file that is sent afterwards. ``options['progress']``
+    is called once, when COPY ends.
     """
-    streaming_enabled = (
+    streaming_enabled = out is None and (
         getattr(settings, 'ADMINACTIONS_STREAM_CSV', False)
     )
     if out is None:
@@ -193,19 +621,62 @@ def export_as_csv(queryset, fields=None, header=None,  # noqa
 
     settingstime_zone = pytz.timezone(settings.TIME_ZONE)
 
+    copy_sql = None
+    if get_csv_engine(config) == 'copy':
+        copy_sql = _get_copy_sql(queryset, fields, config)
+
+    header_writer = writer
+    if copy_sql is not None:
+        # COPY ends lines with '\n'
+        header_writer = csv.writer(buffer_object,
+                                   delimiter=str(config['delimiter']),
+                                   quotechar=str(config['quotechar']),
+                                   quoting=int(config['quoting']),
+                                   lineterminator=str('\n'))
+
     def yield_header():
         if bool(header):
             if isinstance(header, (list, tuple)):
-                yield writer.writerow(header)
+                yield header_writer.writerow(header)
             else:
-                yield writer.writerow([f for f in fields])
+                yield header_writer.writerow([f for f in fields])
         yield ''
 
+    def copy_to(out):
+        rows = _copy_to(queryset.db, copy_sql, out)
+        if config.get('progress') and rows >= 0:
+            config['progress'](rows)
+
+    def yield_copy():
+        if not streaming_enabled:
+            copy_to(response)
+            return
+        # COPY pushes all the data into a file: the whole export is written
+        # in a temporary file before the first chunk is sent
+        tmp = tempfile.TemporaryFile()
+        try:
+            copy_to(tmp)
+            tmp.seek(0)
+            for chunk in FileWrapper(tmp):
+                yield chunk
+        finally:
+            tmp.close()
+
     def yield_rows():
-        for obj in queryset:
+        if copy_sql is not None:
+            for chunk in yield_copy():
+                yield chunk
+            return
+        rows, get_accessors = _get_rows(queryset, fields, chunk_size=get_export_chunk_size(config),
+                                        progress=config.get('progress'), fetch_size=get_export_fetch_size(config))
+        klass = accessors = None
+        for obj in rows:
+            if obj.__class__ is not klass:
+                klass = obj.__class__
+                accessors = get_accessors(obj)
             row = []
-            for fieldname in fields:
-                value = get_field_value(obj, fieldname)
+            for accessor in accessors:
+                value = accessor(obj)
                 if isinstance(value, datetime.datetime):
                     try:
                         value = dateformat.format(value.astimezone(settingstime_zone), config['datetime_format'])
@@ -315,23 +786,36 @@ def export_as_xls2(queryset, fields=None, header=None,  # noqa
 
     sheet.row(row).height = 500
     formats = _get_qs_formats(queryset)
+    # styles are built once for each format and shared by all the cells of the column
+    styles = {}
+    column_formats = []
+    column_styles = []
+    for idx in range(len(fields)):
+        fmt = formats.get(idx, 'general')
+        num_format_str = 'formula' if callable(fmt) else fmt
+        if num_format_str not in styles:
+            styles[num_format_str] = xlwt.easyxf(num_format_str=num_format_str)
+        column_formats.append(fmt)
+        column_styles.append(styles[num_format_str])
 
     settingstime_zone = pytz.timezone(settings.TIME_ZONE)
 
-    for rownum, row in enumerate(queryset):
+    rows, get_accessors = _get_rows(queryset, fields, usedisplay=use_display, raw_callable=False,
+                                    chunk_size=get_export_chunk_size(config), progress=config.get('progress'),
+                                    fetch_size=get_export_fetch_size(config))
+    klass = accessors = None
+    for rownum, row in enumerate(rows):
+        if row.__class__ is not klass:
+            klass = row.__class__
+            accessors = get_accessors(row)
         sheet.write(rownum + 1, 0, rownum + 1)
-        for idx, fieldname in enumerate(fields):
-            fmt = formats.get(idx, 'general')
+        for idx, accessor in enumerate(accessors):
+            fmt = column_formats[idx]
+            style = column_styles[idx]
             try:
-                value = get_field_value(row,
-                                        fieldname,
-                                        usedisplay=use_display,
-                                        raw_callable=False)
+                value = accessor(row)
                 if callable(fmt):
                     value = xlwt.Formula(fmt(value))
-                    style = xlwt.easyxf(num_format_str='formula')
-                else:
-                    style = xlwt.easyxf(num_format_str=fmt)
 
                 if isinstance(value, datetime.datetime):
                     try:
@@ -371,19 +855,22 @@ xlsxwriter_options = {'date_format': 'd/m/Y',
 
 
 def export_as_xls3(queryset, fields=None, header=None,  # noqa
-                   filename=None, options=None, out=None):  # pragma: no cover
-    # sheet_name=None,  header_alt=None,
-    # formatting=None, out=None):
+                   filename=None, options=None, out=None):
     """
-    Exports a queryset as xls from a queryset with the given fields.
+    Exports a queryset as xlsx from a queryset with the given fields.
+
+    The workbook is written using xlsxwriter ``constant_memory`` mode: each row
+    is flushed to disk as soon as it is completed, so memory usage does not depend
+    on the number of rows and there is no 65536 rows limit.
 
     :param queryset: queryset to export (can also be list of namedtuples)
     :param fields: list of fields names to export. None for all fields
     :param header: if True, the exported file will have the first row as column names
-    :param out: object that implements File protocol.
-    :param header_alt: if is not None, and header is True, the first row will be as header_alt (same nr columns)
-    :param formatting: if is None will use formatting_default
-    :return: HttpResponse instance if out not supplied, otherwise out
+    :param filename: name of the filename
+    :param options: XLSOptions() instance or none
+    :param out: object that implements File protocol. If None a temporary file is
+                used and streamed back using StreamingHttpResponse
+    :return: StreamingHttpResponse instance if out not supplied, otherwise out
     """
     import xlsxwriter
 
@@ -398,26 +885,12 @@ def export_as_xls3(queryset, fields=None, header=None,  # noqa
                     formats[fieldname] = fmt
                 except FieldDoesNotExist:
                     pass
-                    # styles[i] = xlwt.easyxf(num_format_str=xls_options_default.get(col_class, 'general'))
-                    # styles[i] = xls_options_default.get(col_class, 'general')
 
         return formats
 
     http_response = out is None
     if out is None:
-        # if filename is None:
-        # filename = filename or "%s.xls" % queryset.model._meta.verbose_name_plural.lower().replace(" ", "_")
-        # response = HttpResponse(content_type='application/vnd.ms-excel')
-        # response['Content-Disposition'] = 'attachment;filename="%s"' % filename.encode('us-ascii', 'replace')
-        # out = io.BytesIO()
-
-        if six.PY2:
-            out = six.StringIO()
-        elif six.PY3:
-            out = six.StringIO()
-            # out = io.BytesIO()
-        else:
-            raise EnvironmentError('Python version not supported')
+        out = tempfile.TemporaryFile()
 
     config = xlsxwriter_options.copy()
     if options:
@@ -426,35 +899,37 @@ def export_as_xls3(queryset, fields=None, header=None,  # noqa
     if fields is None:
         fields = [f.name for f in queryset.model._meta.fields]
 
-    book = xlsxwriter.Workbook(out, {'in_memory': True})
+    book = xlsxwriter.Workbook(out, {'constant_memory': True})
     sheet_name = config.pop('sheet_name')
     use_display = config.get('use_display', False)
     sheet = book.add_worksheet(sheet_name)
-    book.close()
     formats = _get_qs_formats(queryset)
+    general = formats['_general_']
+    column_formats = [formats.get(fieldname, general) for fieldname in fields]
 
-    row = 0
-    sheet.write(row, 0, force_text('#'), formats['_general_'])
+    sheet.write(0, 0, force_text('#'), general)
     if header:
         if not isinstance(header, (list, tuple)):
-            header = [force_text(f.verbose_name)for f in queryset.model._meta.fields if f.name in fields]
+            header = [force_text(f.verbose_name) for f in queryset.model._meta.fields if f.name in fields]
 
         for col, fieldname in enumerate(header, start=1):
-            sheet.write(row, col, force_text(fieldname), formats['_general_'])
+            sheet.write(0, col, force_text(fieldname), general)
 
     settingstime_zone = pytz.timezone(settings.TIME_ZONE)
 
-    for rownum, row in enumerate(queryset):
-        sheet.write(rownum + 1, 0, rownum + 1)
-        for idx, fieldname in enumerate(fields):
-            fmt = formats.get(fieldname, formats['_general_'])
+    rows, get_accessors = _get_rows(queryset, fields, usedisplay=use_display, raw_callable=False,
+                                    chunk_size=get_export_chunk_size(config), progress=config.get('progress'),
+                                    fetch_size=get_export_fetch_size(config))
+    klass = accessors = None
+    for rownum, row in enumerate(rows, start=1):
+        if row.__class__ is not klass:
+            klass = row.__class__
+            accessors = get_accessors(row)
+        sheet.write(rownum, 0, rownum)
+        for idx, accessor in enumerate(accessors):
+            fmt = column_formats[idx]
             try:
-                value = get_field_value(row,
-                                        fieldname,
-                                        usedisplay=use_display,
-                                        raw_callable=False)
-                if callable(fmt):
-                    value = fmt(value)
+                value = accessor(row)
                 if isinstance(value, (list, tuple)):
                     value = smart_text(u"".join(value))
 
@@ -463,27 +938,30 @@ def export_as_xls3(queryset, fields=None, header=None,  # noqa
                         value = dateformat.format(value.astimezone(settingstime_zone), config['datetime_format'])
                     except ValueError:
                         value = dateformat.format(value, config['datetime_format'])
-
-                if isinstance(value, six.binary_type):
+                elif fmt is general and isinstance(value, datetime.date):
+                    value = dateformat.format(value, config['date_format'])
+                elif fmt is general and isinstance(value, datetime.time):
+                    value = dateformat.format(value, config['time_format'])
+                elif isinstance(value, six.binary_type):
                     value = smart_text(value)
 
-                    sheet.write(rownum + 1, idx + 1, smart_text(value), fmt)
+                sheet.write(rownum, idx + 1, value, fmt)
             except Exception as e:
-                raise
-                sheet.write(rownum + 1, idx + 1, smart_text(e), fmt)
+                sheet.write(rownum, idx + 1, smart_text(e), fmt)
 
     book.close()
-    out.seek(0)
     if http_response:
         if filename is None:
-            filename = filename or "%s.xls" % queryset.model._meta.verbose_name_plural.lower().replace(" ", "_")
-        response = HttpResponse(out.read(),
-                                content_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
-        # content_type='application/vnd.ms-excel')
-        # response['Content-Disposition'] = six.b('attachment;filename="%s"') % six.b(filename.encode('us-ascii', 'replace'))
-        response['Content-Disposition'] = six.b('attachment;filename="%s"' % filename)
+            filename = "%s.xlsx" % queryset.model._meta.verbose_name_plural.lower().replace(" ", "_")
+        size = out.tell()
+        out.seek(0)
+        response = StreamingHttpResponse(FileWrapper(out),
+                                         content_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
+        response['Content-Length'] = size
+        response['Content-Disposition'] = ('attachment;filename="%s"' % filename).encode('us-ascii', 'replace')
         return response
     return out
 
 
+export_as_xlsx = export_as_xls3
 export_as_xls = export_as_xls2
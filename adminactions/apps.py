@@ -0,0 +1,12 @@
+from __future__ import absolute_import, unicode_literals
+
+from django.apps import AppConfig
+
+
+class Config(AppConfig):
+    name = 'adminactions'
+
+    def ready(self):
+        from adminactions.graph import connect_graph_cache
+
+        connect_graph_cache()
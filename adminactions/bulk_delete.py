@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, unicode_literals
+import logging
+from django import forms
+from django.contrib import messages
+from django.contrib.admin import helpers
+from django.db.models.deletion import ProtectedError
+from django.http import HttpResponseRedirect
+from django.shortcuts import render_to_response
+from django.template.context import RequestContext
+from django.utils.encoding import smart_text
+from django.utils.translation import ugettext as _
+
+from adminactions import api
+from adminactions.exceptions import ActionInterrupted
+from adminactions.models import get_permission_codename
+from adminactions.signals import adminaction_requested, adminaction_start, adminaction_end
+
+logger = logging.getLogger(__name__)
+
+
+class BulkDeleteForm(forms.Form):
+    _selected_action = forms.CharField(widget=forms.MultipleHiddenInput)
+    select_across = forms.BooleanField(label='', required=False, initial=0,
+                                       widget=forms.HiddenInput({'class': 'select-across'}))
+    action = forms.CharField(label='', required=True, initial='', widget=forms.HiddenInput())
+
+    chunk_size = forms.IntegerField(label=_('Records for each transaction'), min_value=1)
+
+
+def bulk_delete(modeladmin, request, queryset):
+    """
+    Delete the selected records, and their cascade, in chunks. Each chunk is deleted
+    in its own transaction
+    """
+    opts = modeladmin.model._meta
+    perm = "{0}.{1}".format(opts.app_label.lower(), get_permission_codename('delete', opts))
+    if not request.user.has_perm(perm):
+        messages.error(request, _('Sorry you do not have rights to execute this action (%s)' % perm))
+        return
+
+    summary = api.get_delete_summary(queryset)
+    # as django's delete_selected: the user must be able to delete all the records of the cascade
+    # that belong to models registered in the admin site
+    perms_needed = []
+    for model, count in summary:
+        model_opts = model._meta
+        if count and model in modeladmin.admin_site._registry:
+            model_perm = '%s.%s' % (model_opts.app_label, get_permission_codename('delete', model_opts))
+            if not request.user.has_perm(model_perm):
+                perms_needed.append(smart_text(model_opts.verbose_name))
+    if perms_needed:
+        messages.error(request, _('Sorry you do not have rights to delete: %s') % ', '.join(perms_needed))
+        return
+
+    try:
+        adminaction_requested.send(sender=modeladmin.model,
+                                   action='bulk_delete',
+                                   request=request,
+                                   queryset=queryset,
+                                   modeladmin=modeladmin)
+    except ActionInterrupted as e:
+        messages.error(request, str(e))
+        return
+
+    if 'apply' in request.POST:
+        form = BulkDeleteForm(request.POST)
+        if form.is_valid():
+            try:
+                adminaction_start.send(sender=modeladmin.model,
+                                       action='bulk_delete',
+                                       request=request,
+                                       queryset=queryset,
+                                       modeladmin=modeladmin,
+                                       form=form)
+            except ActionInterrupted as e:
+                messages.error(request, str(e))
+                return HttpResponseRedirect(request.get_full_path())
+
+            total = queryset.count()
+
+            def progress(deleted):
+                logger.info('%s: deleted %s of %s %s' % (request.user, deleted, total, opts.verbose_name_plural))
+
+            errors = []
+            deleted = 0
+            try:
+                deleted = api.bulk_delete(queryset, form.cleaned_data['chunk_size'], progress)
+            except ProtectedError as e:
+                # records deleted before the error are not restored
+                deleted = total - queryset.count()
+                errors.append(e)
+                messages.error(request, smart_text(e.args[0]))
+            if deleted:
+                messages.info(request, _("Deleted %s records") % deleted)
+            adminaction_end.send(sender=modeladmin.model,
+                                 action='bulk_delete',
+                                 request=request,
+                                 queryset=queryset,
+                                 modeladmin=modeladmin,
+                                 form=form,
+                                 errors=errors,
+                                 updated=deleted)
+            return HttpResponseRedirect(request.get_full_path())
+    else:
+        initial = {helpers.ACTION_CHECKBOX_NAME: request.POST.getlist(helpers.ACTION_CHECKBOX_NAME),
+                   'action': 'bulk_delete',
+                   'select_across': request.POST.get('select_across') == '1',
+                   'chunk_size': api.get_delete_chunk_size()}
+        form = BulkDeleteForm(initial=initial)
+
+    adminForm = helpers.AdminForm(form, modeladmin.get_fieldsets(request), {}, [], model_admin=modeladmin)
+    media = modeladmin.media + adminForm.media
+    ctx = {'adminform': adminForm,
+           'form': form,
+           'action': 'bulk_delete',
+           'summary': [(model._meta, count) for model, count in summary],
+           'summary_truncated': summary.truncated,
+           'opts': opts,
+           'app_label': opts.app_label,
+           'title': _("Delete %s") % smart_text(opts.verbose_name_plural),
+           'media': media}
+    return render_to_response('adminactions/bulk_delete.html', RequestContext(request, ctx))
+
+
+bulk_delete.short_description = _("Delete selected %(verbose_name_plural)s in chunks")
@@ -6,6 +6,23 @@ import django.db.transaction as t
 
 version = django.VERSION[:2]
 
+if version < (1, 6):
+    from django.db import close_connection as close_old_connections  # noqa
+else:
+    from django.db import close_old_connections  # noqa
+
+if version < (1, 7):
+    from django.core.cache import get_cache  # noqa
+    from django.db.models import get_model  # noqa
+else:
+    from django.apps import apps
+    from django.core.cache import caches
+
+    get_model = apps.get_model
+
+    def get_cache(alias):
+        return caches[alias]
+
 if version in ((1, 5), (1, 4)):  # noqa
 
     @contextmanager
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, unicode_literals
+from django import forms
+from django.conf import settings
+from django.contrib import messages
+from django.contrib.admin import helpers
+from django.forms.forms import DeclarativeFieldsMetaclass
+from django.shortcuts import render_to_response
+from django.template.context import RequestContext
+from django.utils.encoding import smart_text
+from django.utils.translation import ugettext as _
+
+from adminactions import api
+from adminactions.exceptions import ActionInterrupted
+from adminactions.models import get_permission_codename
+from adminactions.signals import adminaction_requested, adminaction_start, adminaction_end
+
+
+def duplicates_form_factory(model):
+    model_fields = [(f.name, f.verbose_name) for f in model._meta.fields
+                    if not f.primary_key and not f.rel and f.editable]
+    keys = [(name, description) for name, (__, description) in api.BLOCKING_KEYS.items()]
+    class_name = "%s%sDuplicatesForm" % (model._meta.app_label, model.__name__)
+    attrs = {'_selected_action': forms.CharField(widget=forms.MultipleHiddenInput),
+             'select_across': forms.BooleanField(label='', required=False, initial=0,
+                                                 widget=forms.HiddenInput({'class': 'select-across'})),
+             'action': forms.CharField(label='', required=True, initial='', widget=forms.HiddenInput()),
+             'fields': forms.MultipleChoiceField(label=_('Compare'), choices=model_fields),
+             'key': forms.ChoiceField(label=_('Match'), initial='normalized', choices=keys),
+             'min_size': forms.IntegerField(label=_('Min records'), initial=2, min_value=2)}
+
+    return DeclarativeFieldsMetaclass(str(class_name), (forms.Form,), attrs)
+
+
+def find_duplicates(modeladmin, request, queryset):  # noqa
+    """
+    Find the likely duplicates of the selected records. Each cluster can be merged
+    using the `merge` action
+    """
+    opts = modeladmin.model._meta
+    perm = "{0}.{1}".format(opts.app_label.lower(), get_permission_codename('adminactions_merge', opts))
+    if not request.user.has_perm(perm):
+        messages.error(request, _('Sorry you do not have rights to execute this action (%s)' % perm))
+        return
+
+    try:
+        adminaction_requested.send(sender=modeladmin.model,
+                                   action='find_duplicates',
+                                   request=request,
+                                   queryset=queryset,
+                                   modeladmin=modeladmin)
+    except ActionInterrupted as e:
+        messages.error(request, str(e))
+        return
+
+    MForm = duplicates_form_factory(modeladmin.model)
+    clusters = None
+    if 'apply' in request.POST:
+        form = MForm(request.POST)
+        if form.is_valid():
+            try:
+                adminaction_start.send(sender=modeladmin.model,
+                                       action='find_duplicates',
+                                       request=request,
+                                       queryset=queryset,
+                                       modeladmin=modeladmin,
+                                       form=form)
+            except ActionInterrupted as e:
+                messages.error(request, str(e))
+                return
+
+            pks = api.find_duplicates(queryset, form.cleaned_data['fields'], form.cleaned_data['key'],
+                                      form.cleaned_data['min_size'], api.get_export_chunk_size())
+            total = len(pks)
+            pks = pks[:getattr(settings, 'ADMINACTIONS_DUPLICATES_MAX_CLUSTERS', 100)]
+            max_records = getattr(settings, 'ADMINACTIONS_DUPLICATES_MAX_RECORDS', 10)
+            records = queryset.model._default_manager.in_bulk([pk for cluster in pks for pk in cluster[:max_records]])
+            clusters = [{'records': [records[pk] for pk in cluster[:max_records] if pk in records],
+                         'count': len(cluster)} for cluster in pks]
+            if total > len(clusters):
+                messages.info(request, _('Showing %(shown)s of %(total)s groups') % {'shown': len(clusters),
+                                                                                     'total': total})
+            adminaction_end.send(sender=modeladmin.model,
+                                 action='find_duplicates',
+                                 request=request,
+                                 queryset=queryset,
+                                 modeladmin=modeladmin,
+                                 form=form)
+    else:
+        initial = {helpers.ACTION_CHECKBOX_NAME: request.POST.getlist(helpers.ACTION_CHECKBOX_NAME),
+                   'action': 'find_duplicates',
+                   'select_across': request.POST.get('select_across') == '1'}
+        form = MForm(initial=initial)
+
+    adminForm = helpers.AdminForm(form, modeladmin.get_fieldsets(request), {}, [], model_admin=modeladmin)
+    media = modeladmin.media + adminForm.media
+    ctx = {'adminform': adminForm,
+           'form': form,
+           'action': 'find_duplicates',
+           'clusters': clusters,
+           'searched': clusters is not None,
+           'opts': opts,
+           'app_label': opts.app_label,
+           'title': u"Find duplicates %s" % smart_text(opts.verbose_name_plural),
+           'media': media}
+    return render_to_response('adminactions/duplicates.html', RequestContext(request, ctx))
+
+
+find_duplicates.short_description = _("Find duplicates")
@@ -1,26 +1,35 @@
 # -*- encoding: utf-8 -*-
 from __future__ import absolute_import, unicode_literals
-from itertools import chain
+import collections
+import functools
+import itertools
+import six
 from django.core.serializers import get_serializer_formats
-from django.db import router
-from django.db.models import ManyToManyField, ForeignKey
+from django.db import connections, router
+from django.db.models import ForeignKey
 from django.db.models.deletion import Collector
 from django.utils.translation import ugettext_lazy as _
 from django import forms
 from django.conf import settings
 from django.contrib import messages
+from django.core.urlresolvers import reverse
 from django.http import HttpResponse, HttpResponseRedirect
 from django.shortcuts import render_to_response
 from django.template.context import RequestContext
 from django.utils.safestring import mark_safe
 from django.contrib.admin import helpers
 from django.core import serializers as ser
+from django.core.serializers import json as json_serializer, xml_serializer
 from adminactions.exceptions import ActionInterrupted
 from adminactions.forms import CSVOptions, XLSOptions
+from adminactions.jobs import enqueue_export
 from adminactions.models import get_permission_codename
 from adminactions.signals import adminaction_requested, adminaction_start, adminaction_end
-from adminactions.api import export_as_csv as _export_as_csv, export_as_xls as _export_as_xls
-from six.moves import zip
+from adminactions.api import (export_as_csv as _export_as_csv, export_as_xls as _export_as_xls,
+                               get_delete_summary, get_export_chunk_size, get_export_fetch_size,
+                               StreamingHttpResponse)
+from adminactions.utils import iter_queryset
+from six.moves import range, zip
 
 
 def get_action(request):
@@ -79,6 +88,16 @@ def base_export(modeladmin, request, queryset, title, impl, name, template, form
                 filename = modeladmin.get_export_as_csv_filename(request, queryset)
             else:
                 filename = None
+            if getattr(settings, 'ADMINACTIONS_EXPORT_ASYNC', False):
+                if filename is None:
+                    filename = "%s.%s" % (opts.verbose_name_plural.lower().replace(" ", "_"), name.split('_')[-1])
+                job = enqueue_export(impl, queryset, filename,
+                                     fields=form.cleaned_data['columns'],
+                                     header=form.cleaned_data.get('header', False),
+                                     options=form.cleaned_data,
+                                     user=request.user,
+                                     action=name)
+                return HttpResponseRedirect(reverse('adminactions.export_status', args=[job.id]))
             try:
                 response = impl(queryset,
                                 fields=form.cleaned_data['columns'],
@@ -147,37 +166,86 @@ class FlatCollector(object):
         super(FlatCollector, self).__init__()
 
     def collect(self, objs):
-        self.data = objs
-        self.models = set([o.__class__ for o in self.data])
+        if hasattr(objs, 'model'):
+            self.data = iter_queryset(objs, get_export_chunk_size(), get_export_fetch_size())
+            self.models = set([objs.model])
+        else:
+            self.data = objs
+            self.models = set([o.__class__ for o in self.data])
 
 
 class ForeignKeysCollector(object):
+    """
+    collects the records of a queryset and all the records they point to, following
+    ForeignKeys and ManyToManyFields.
+
+    Relations are walked breadth first: the records of each level are read with one
+    query for each model (and each batch of primary keys), not one for each ForeignKey.
+    """
+
     def __init__(self, using):
-        self._visited = []
+        self.using = using
+        self._visited = set()
         super(ForeignKeysCollector, self).__init__()
 
-    def _collect(self, objs):
-        objects = []
-        for obj in objs:
-            if obj and obj not in self._visited:
-                concrete_model = obj._meta.concrete_model
-                obj = concrete_model.objects.get(pk=obj.pk)
-                opts = obj._meta
-
-                self._visited.append(obj)
-                objects.append(obj)
-                for field in chain(opts.fields, opts.local_many_to_many):
-                    if isinstance(field, ManyToManyField):
-                        target = getattr(obj, field.name).all()
-                        objects.extend(self._collect(target))
-                    elif isinstance(field, ForeignKey):
-                        target = getattr(obj, field.name)
-                        objects.extend(self._collect([target]))
-        return objects
+    def _batches(self, model, items):
+        connection = connections[self.using or router.db_for_read(model)]
+        size = max(connection.ops.bulk_batch_size(['pk'], items), 1)
+        for i in range(0, len(items), size):
+            yield items[i:i + size]
+
+    def _add(self, pending, model, pks):
+        model = model._meta.concrete_model
+        for pk in pks:
+            if pk is not None and (model, pk) not in self._visited:
+                self._visited.add((model, pk))
+                pending.setdefault(model, []).append(pk)
+
+    def _follow(self, model, objs, pending):
+        opts = model._meta
+        for batch in self._batches(model, objs):
+            for field in opts.fields:
+                if isinstance(field, ForeignKey):
+                    target = field.rel.to
+                    values = [getattr(obj, field.attname) for obj in batch]
+                    if not field.rel.get_related_field().primary_key:
+                        lookup = '%s__in' % field.rel.field_name
+                        values = target._base_manager.using(self.using).filter(**{lookup: set(values) - {None}})\
+                            .values_list('pk', flat=True)
+                    self._add(pending, target, values)
+            for field in opts.local_many_to_many:
+                lookup = '%s__in' % field.m2m_field_name()
+                values = field.rel.through._base_manager.using(self.using) \
+                    .filter(**{lookup: [obj.pk for obj in batch]}) \
+                    .values_list(field.m2m_reverse_field_name(), flat=True)
+                self._add(pending, field.rel.to, values)
 
     def collect(self, objs):
-        self._visited = []
-        self.data = self._collect(objs)
+        self._visited = set()
+        self.data = []
+        pending = collections.OrderedDict()
+        selected = collections.OrderedDict()
+        for obj in iter_queryset(objs, get_export_chunk_size(), get_export_fetch_size()):
+            model = obj._meta.concrete_model
+            if obj.__class__ is model:
+                # no need to read it again
+                self._visited.add((model, obj.pk))
+                self.data.append(obj)
+                selected.setdefault(model, []).append(obj)
+            else:
+                self._add(pending, model, [obj.pk])
+        for model, records in selected.items():
+            self._follow(model, records, pending)
+
+        while pending:
+            level, pending = pending, collections.OrderedDict()
+            for model, pks in level.items():
+                records = []
+                for batch in self._batches(model, pks):
+                    found = model._base_manager.using(self.using).in_bulk(batch)
+                    records.extend(found[pk] for pk in batch if pk in found)
+                self.data.extend(records)
+                self._follow(model, records, pending)
         self.models = set([o.__class__ for o in self.data])
 
     def __str__(self):
@@ -198,18 +266,97 @@ class FixtureOptions(forms.Form):
     serializer = forms.ChoiceField(choices=list(zip(get_serializer_formats(), get_serializer_formats())))
 
 
-def _dump_qs(form, queryset, data, filename):
+STREAMING_SERIALIZERS = (json_serializer.Serializer, xml_serializer.Serializer)
+
+
+def _serialize_iter(serializer, objs, chunk_size=100, **options):
+    """
+    same as `serializer.serialize(objs, **options)` but yields the document
+    every `chunk_size` objects instead of building it in memory.
+
+    Each chunk is serialized by `serializer.serialize()` writing to the same stream:
+    the document is opened by the first call and closed only after the last chunk.
+    Only works with serializers that write to the stream as soon as
+    each object is processed (see `STREAMING_SERIALIZERS`)
+    """
+    stream = six.StringIO()
+    start_serialization = serializer.start_serialization
+    end_serialization = serializer.end_serialization
+    start_object = serializer.start_object
+    state = {'objects': 0}
+
+    def flush():
+        value = stream.getvalue()
+        stream.seek(0)
+        stream.truncate(0)
+        return value
+
+    def _start_object(obj):
+        # serialize() sets `first` at each call, but only one object is the first of the document
+        serializer.first = not state['objects']
+        state['objects'] += 1
+        start_object(obj)
+
+    serializer.start_object = _start_object
+    serializer.end_serialization = lambda: None
+    # opens the document
+    serializer.serialize([], stream=stream, **options)
+    serializer.start_serialization = lambda: None
+    try:
+        chunk = []
+        for obj in objs:
+            chunk.append(obj)
+            if len(chunk) == chunk_size:
+                serializer.serialize(chunk, stream=stream, **options)
+                chunk = []
+                yield flush()
+        serializer.serialize(chunk, stream=stream, **options)
+        end_serialization()
+        yield flush()
+    finally:
+        serializer.start_serialization = start_serialization
+        serializer.end_serialization = end_serialization
+        serializer.start_object = start_object
+
+
+def _send_at_end(content, callback):
+    try:
+        for chunk in content:
+            yield chunk
+    finally:
+        callback()
+
+
+def _dump_qs(form, queryset, data, filename, done=None):
+    """
+    returns the response with `data` serialized. `done` is called when the document is complete:
+    when the response is streamed, after the last chunk is sent.
+
+    Errors in the first chunk are raised here; errors in the following chunks truncate the file
+    """
     fmt = form.cleaned_data.get('serializer')
+    done = done or (lambda: None)
 
-    json = ser.get_serializer(fmt)()
-    ret = json.serialize(data, use_natural_keys=form.cleaned_data.get('use_natural_key', False),
-                         indent=form.cleaned_data.get('indent'))
+    serializer = ser.get_serializer(fmt)()
+    options = {'use_natural_keys': form.cleaned_data.get('use_natural_key', False),
+               'indent': form.cleaned_data.get('indent')}
 
-    response = HttpResponse(content_type='application/json')
+    if isinstance(serializer, STREAMING_SERIALIZERS):
+        response = StreamingHttpResponse(content_type='application/json')
+        content = _serialize_iter(serializer, data, get_export_chunk_size() or 100, **options)
+        # serialize the first chunk now, so errors can be reported without a broken download
+        content = _send_at_end(itertools.chain([next(content)], content), done)
+    else:
+        response = HttpResponse(content_type='application/json')
+        content = serializer.serialize(data, **options)
+        done()
     if not form.cleaned_data.get('on_screen', False):
         filename = filename or "%s.%s" % (queryset.model._meta.verbose_name_plural.lower().replace(" ", "_"), fmt)
         response['Content-Disposition'] = ('attachment;filename="%s"' % filename).encode('us-ascii', 'replace')
-    response.content = ret
+    if getattr(response, 'streaming', False):
+        response.streaming_content = content
+    else:
+        response.content = content
     return response
 
 
@@ -253,18 +400,19 @@ def export_as_fixture(modeladmin, request, queryset):
                 _collector = ForeignKeysCollector if form.cleaned_data.get('add_foreign_keys') else FlatCollector
                 c = _collector(None)
                 c.collect(queryset)
-                adminaction_end.send(sender=modeladmin.model,
-                                     action='export_as_fixture',
-                                     request=request,
-                                     queryset=queryset,
-                                     modeladmin=modeladmin,
-                                     form=form)
+                done = functools.partial(adminaction_end.send,
+                                         sender=modeladmin.model,
+                                         action='export_as_fixture',
+                                         request=request,
+                                         queryset=queryset,
+                                         modeladmin=modeladmin,
+                                         form=form)
 
                 if hasattr(modeladmin, 'get_export_as_fixture_filename'):
                     filename = modeladmin.get_export_as_fixture_filename(request, queryset)
                 else:
                     filename = None
-                return _dump_qs(form, queryset, c.data, filename)
+                return _dump_qs(form, queryset, c.data, filename, done)
             except AttributeError as e:
                 messages.error(request, str(e))
                 return HttpResponseRedirect(request.path)
@@ -341,28 +489,34 @@ def export_delete_tree(modeladmin, request, queryset):
                 data = []
                 for model, instances in list(c.data.items()):
                     data.extend(instances)
-                adminaction_end.send(sender=modeladmin.model,
-                                     action='export_delete_tree',
-                                     request=request,
-                                     queryset=queryset,
-                                     modeladmin=modeladmin,
-                                     form=form)
+                done = functools.partial(adminaction_end.send,
+                                         sender=modeladmin.model,
+                                         action='export_delete_tree',
+                                         request=request,
+                                         queryset=queryset,
+                                         modeladmin=modeladmin,
+                                         form=form)
                 if hasattr(modeladmin, 'get_export_delete_tree_filename'):
                     filename = modeladmin.get_export_delete_tree_filename(request, queryset)
                 else:
                     filename = None
-                return _dump_qs(form, queryset, data, filename)
+                return _dump_qs(form, queryset, data, filename, done)
             except AttributeError as e:
                 messages.error(request, str(e))
                 return HttpResponseRedirect(request.path)
     else:
         form = FixtureOptions(initial=initial)
 
+    # what would be deleted, without loading the records
+    summary = get_delete_summary(queryset)
+
     adminForm = helpers.AdminForm(form, modeladmin.get_fieldsets(request), {}, model_admin=modeladmin)
     media = modeladmin.media + adminForm.media
     tpl = 'adminactions/export_fixture.html'
     ctx = {'adminform': adminForm,
            'change': True,
+           'summary': [(model._meta, count) for model, count in summary],
+           'summary_truncated': summary.truncated,
            'title': _('Export Delete Tree'),
            'is_popup': False,
            'save_as': False,
@@ -5,20 +5,31 @@ Created on 28/ott/2009
 @author: sax
 '''
 from __future__ import absolute_import, unicode_literals
-from django.db.models.aggregates import Count
+import datetime
+import hashlib
+from decimal import Decimal
+from collections import OrderedDict
+from django.conf import settings
+from django.db import connections, models
+from django.db.models.aggregates import Avg, Count, Max, Min, Sum
 from django.db.models.fields.related import ForeignKey
-from django.forms.fields import CharField, BooleanField, ChoiceField
+from django.db.models.signals import post_delete, post_save
+from django.db.models.sql.datastructures import EmptyResultSet
+from django.forms.fields import CharField, BooleanField, ChoiceField, IntegerField
 from django.forms.forms import Form, DeclarativeFieldsMetaclass
 from django.forms.widgets import HiddenInput, MultipleHiddenInput
 import json
 from django.contrib import messages
 from django.shortcuts import render_to_response
 from django.template.context import RequestContext
-from django.utils.encoding import smart_text
+from django.utils import timezone
+from django.utils.encoding import smart_bytes, smart_text
 from django.contrib.admin import helpers
 
+from adminactions import compat
 from adminactions.exceptions import ActionInterrupted
 from adminactions.signals import adminaction_requested, adminaction_start, adminaction_end
+import six
 from six.moves import zip
 
 
@@ -27,6 +38,9 @@ def graph_form_factory(model):
     model_name = model.__name__
 
     model_fields = [(f.name, f.verbose_name) for f in model._meta.fields if not f.primary_key]
+    measures = [(f.name, f.verbose_name) for f in model._meta.fields
+                if isinstance(f, (models.IntegerField, models.FloatField, models.DecimalField)) and not f.primary_key]
+    measures.insert(0, ('', 'N/A'))
     graphs = [('PieChart', 'PieChart'), ('BarChart', 'BarChart')]
     model_fields.insert(0, ('', 'N/A'))
     class_name = "%s%sGraphForm" % (app_name, model_name)
@@ -36,11 +50,230 @@ def graph_form_factory(model):
              'app': CharField(initial=app_name, widget=HiddenInput),
              'model': CharField(initial=model_name, widget=HiddenInput),
              'graph_type': ChoiceField(label="Graph type", choices=graphs, required=True),
-             'axes_x': ChoiceField(label="Group by and count by", choices=model_fields, required=True)}
+             'axes_x': ChoiceField(label="Group by and count by", choices=model_fields, required=True),
+             'top': IntegerField(label="Max groups", required=False, min_value=1,
+                                 help_text="show only the most frequent values, the others are grouped as 'Other'"),
+             'bucket': ChoiceField(label="Time series by", choices=BUCKETS, required=False,
+                                   help_text="group date fields by day/week/month/year"),
+             'measure': ChoiceField(label="Measure", choices=measures, required=False,
+                                    help_text="field to aggregate. If not set records are counted"),
+             'function': ChoiceField(label="Aggregate", choices=AGGREGATES, required=False, initial='count')}
 
     return DeclarativeFieldsMetaclass(str(class_name), (Form,), attrs)
 
 
+def get_related_labels(field, values):
+    """
+    returns a dict that maps each value of the ForeignKey `field` to
+    the text of the related object, reading all of them with a single query
+    """
+    to_field = field.rel.get_related_field().attname
+    values = [v for v in values if v is not None]
+    related = field.rel.to._default_manager.filter(**{'%s__in' % to_field: values})
+    return dict((getattr(obj, to_field), smart_text(obj)) for obj in related)
+
+
+BUCKETS = (('', 'N/A'), ('day', 'Day'), ('week', 'Week'), ('month', 'Month'), ('year', 'Year'))
+BUCKET_FORMATS = {'day': '%Y-%m-%d', 'week': '%Y-%m-%d', 'month': '%Y-%m', 'year': '%Y'}
+
+
+def _to_date(value):
+    # backends return the truncated value as date, datetime or string
+    if isinstance(value, datetime.datetime):
+        return value.date()
+    elif isinstance(value, datetime.date):
+        return value
+    return datetime.date(*[int(part) for part in smart_text(value)[:10].split('-')])
+
+
+AGGREGATES = (('count', 'Count'), ('sum', 'Sum'), ('avg', 'Average'),
+              ('min', 'Min'), ('max', 'Max'), ('distinct', 'Count distinct'))
+
+
+def get_aggregate(x, measure=None, function='count'):
+    """
+    returns the aggregate expression to compute for each group.
+
+    :param x: name of the field used to group
+    :param measure: name of the field to aggregate. If not set, records are counted
+    :param function: one of `AGGREGATES`
+    """
+    if not measure:
+        if function not in (None, '', 'count'):
+            raise ValueError('%s requires a measure field' % function)
+        return Count(x)
+    if function == 'distinct':
+        return Count(measure, distinct=True)
+    return {None: Count, '': Count, 'count': Count,
+            'sum': Sum, 'avg': Avg, 'min': Min, 'max': Max}[function](measure)
+
+
+def _to_number(value):
+    # Decimal is not json serializable
+    if isinstance(value, Decimal):
+        return float(value)
+    return value
+
+
+def get_time_series(queryset, field, bucket, aggregate=None, function='count'):
+    """
+    returns the labels and the values of `aggregate` (default: number of records)
+    of `queryset` for each day/week/month/year of the date field `field`.
+
+    Values are truncated and grouped by the database; weeks (not supported by
+    the database functions) are computed by grouping days.
+    """
+    if not isinstance(field, models.DateField):
+        raise ValueError('%s is not a date field' % field.name)
+    if bucket == 'week' and function in ('avg', 'distinct'):
+        raise ValueError('%s cannot be computed by week' % function)
+    connection = connections[queryset.db]
+    column = '%s.%s' % (connection.ops.quote_name(field.model._meta.db_table),
+                        connection.ops.quote_name(field.column))
+    kind = 'day' if bucket == 'week' else bucket
+    if isinstance(field, models.DateTimeField):
+        tzname = timezone.get_current_timezone_name() if settings.USE_TZ else None
+        sql, params = connection.ops.datetime_trunc_sql(kind, column, tzname)
+    else:
+        sql, params = connection.ops.date_trunc_sql(kind, column), []
+
+    cc = queryset.exclude(**{'%s__isnull' % field.name: True}) \
+        .extra(select={'bucket': sql}, select_params=params) \
+        .values_list('bucket').annotate(graph_value=aggregate or Count(field.name)).order_by('bucket')
+
+    merge = {'min': min, 'max': max}.get(function, lambda a, b: a + b)
+    series = OrderedDict()
+    for value, cnt in cc:
+        day = _to_date(value)
+        if bucket == 'week':
+            day = day - datetime.timedelta(days=day.weekday())
+        cnt = _to_number(cnt)
+        if cnt is None:
+            cnt = series.get(day)
+        elif series.get(day) is not None:
+            cnt = merge(series[day], cnt)
+        series[day] = cnt
+    return [day.strftime(BUCKET_FORMATS[bucket]) for day in series], list(series.values())
+
+
+def get_graph_data(queryset, x, top=None, bucket=None, measure=None, function='count'):
+    """
+    returns the labels and the number of records of `queryset` grouped by the field `x`.
+
+    :param queryset: queryset to group
+    :param x: name of the field used to group
+    :param top: if set, returns only the `top` groups with the greatest values. The others are
+                computed by a second query and returned as 'Other'
+    :param bucket: day/week/month/year. If set, `x` must be a date field and records
+                   are grouped by the period (see :func:`get_time_series`). `top` is ignored
+    :param measure: name of the field to aggregate instead of counting the records
+    :param function: aggregate function applied to `measure`, one of `AGGREGATES`
+    :return: tuple (labels, values)
+    """
+    field, model, direct, m2m = queryset.model._meta.get_field_by_name(x)
+    aggregate = get_aggregate(x, measure, function)
+    if bucket:
+        return get_time_series(queryset, field, bucket, aggregate, function)
+    cc = queryset.values_list(x).annotate(graph_value=aggregate).order_by()
+    if top:
+        cc = cc.order_by('-graph_value', x)[:top]
+    cc = list(cc)
+    if isinstance(field, ForeignKey):
+        labels = get_related_labels(field, [value for value, cnt in cc])
+        data_labels = [labels.get(value, smart_text(value)) for value, cnt in cc]
+    elif isinstance(field, BooleanField):
+        data_labels = [str(l) for l, v in cc]
+    elif hasattr(queryset.model, 'get_%s_display' % field.name):
+        data_labels = []
+        for value, cnt in cc:
+            data_labels.append(smart_text(dict(field.flatchoices).get(value, value), strings_only=True))
+    else:
+        data_labels = [str(l) for l, v in cc]
+    data = [_to_number(v) for l, v in cc]
+
+    if top:
+        others = queryset.exclude(**{'%s__isnull' % x: True})
+        values = [value for value, cnt in cc if value is not None]
+        if values:
+            others = others.exclude(**{'%s__in' % x: values})
+        other = _to_number(others.aggregate(graph_value=aggregate)['graph_value'])
+        if other:
+            data_labels.append('Other')
+            data.append(other)
+    return data_labels, data
+
+
+def get_graph_cache():
+    """
+    returns the cache used to store the graph data:
+    ``settings.ADMINACTIONS_GRAPH_CACHE`` (the alias of one of ``settings.CACHES``) or
+    None if the cache is disabled (default)
+    """
+    alias = getattr(settings, 'ADMINACTIONS_GRAPH_CACHE', None)
+    if not alias:
+        return None
+    return compat.get_cache(alias)
+
+
+def _get_version_key(model):
+    model = model._meta.concrete_model
+    return 'adminactions:graph:%s.%s' % (model._meta.app_label, model._meta.object_name)
+
+
+def connect_graph_cache():
+    """
+    connects :func:`invalidate_graph_cache` to ``post_save`` and ``post_delete`` of all the models
+    when ``settings.ADMINACTIONS_GRAPH_CACHE`` is set. Called once per process when the app is ready,
+    so that every process invalidates the entries stored by the others
+    """
+    if getattr(settings, 'ADMINACTIONS_GRAPH_CACHE', None):
+        post_save.connect(invalidate_graph_cache, dispatch_uid='adminactions_graph_cache_save')
+        post_delete.connect(invalidate_graph_cache, dispatch_uid='adminactions_graph_cache_delete')
+
+
+def get_cached_graph_data(queryset, x, top=None, bucket=None, measure=None, function='count'):
+    """
+    same as :func:`get_graph_data` but stores the result in :func:`get_graph_cache`
+    for ``settings.ADMINACTIONS_GRAPH_CACHE_TIMEOUT`` seconds (default: 300).
+
+    The key is built from the model, the SQL (and params) of `queryset` and the
+    arguments; saving or deleting any record of the model invalidates its entries.
+    Changes that do not send ``post_save``/``post_delete`` (ie. ``QuerySet.update()``)
+    are visible only when the entries expire.
+    """
+    cache = get_graph_cache()
+    if cache is None:
+        return get_graph_data(queryset, x, top, bucket, measure, function)
+    try:
+        sql, params = queryset.query.sql_with_params()
+    except EmptyResultSet:
+        return get_graph_data(queryset, x, top, bucket, measure, function)
+
+    version_key = _get_version_key(queryset.model)
+    cache.add(version_key, 1, None)
+    version = cache.get(version_key, 1)
+    key = '%s:%s' % (version_key, hashlib.md5(smart_bytes('|'.join(
+        map(smart_text, [version, queryset.db, sql, params, x, top, bucket, measure, function])))).hexdigest())
+    data = cache.get(key)
+    if data is None:
+        data = get_graph_data(queryset, x, top, bucket, measure, function)
+        cache.set(key, data, getattr(settings, 'ADMINACTIONS_GRAPH_CACHE_TIMEOUT', 300))
+    return data
+
+
+def invalidate_graph_cache(sender, **kwargs):
+    """
+    invalidates the graph data of `sender` model. Connected to post_save and post_delete
+    by :func:`connect_graph_cache`
+    """
+    cache = get_graph_cache()
+    if cache is not None:
+        try:
+            cache.incr(_get_version_key(sender))
+        except ValueError:  # never cached
+            pass
+
+
 def graph_queryset(modeladmin, request, queryset):  # noqa
     MForm = graph_form_factory(modeladmin.model)
 
@@ -74,21 +307,11 @@ def graph_queryset(modeladmin, request, queryset):  # noqa
                 # y = form.cleaned_data['axes_y']
                 graph_type = form.cleaned_data['graph_type']
 
-                field, model, direct, m2m = modeladmin.model._meta.get_field_by_name(x)
-                cc = queryset.values_list(x).annotate(Count(x)).order_by()
-                if isinstance(field, ForeignKey):
-                    data_labels = []
-                    for value, cnt in cc:
-                        data_labels.append(str(field.rel.to.objects.get(pk=value)))
-                elif isinstance(field, BooleanField):
-                    data_labels = [str(l) for l, v in cc]
-                elif hasattr(modeladmin.model, 'get_%s_display' % field.name):
-                    data_labels = []
-                    for value, cnt in cc:
-                        data_labels.append(smart_text(dict(field.flatchoices).get(value, value), strings_only=True))
-                else:
-                    data_labels = [str(l) for l, v in cc]
-                data = [v for l, v in cc]
+                data_labels, data = get_cached_graph_data(queryset, x, form.cleaned_data.get('top'),
+                                                          form.cleaned_data.get('bucket'),
+                                                          form.cleaned_data.get('measure'),
+                                                          form.cleaned_data.get('function'))
+                value_format = '%d' if all(isinstance(v, six.integer_types) for v in data) else '%.2f'
 
                 if graph_type == 'BarChart':
                     table = [data]
@@ -101,9 +324,9 @@ def graph_queryset(modeladmin, request, queryset):  # noqa
                                 axes: {yaxis: {renderer: $.jqplot.CategoryAxisRenderer,
                                                 ticks: %s},
                                        xaxis: {pad: 1.05,
-                                               tickOptions: {formatString: '%%d'}}
+                                               tickOptions: {formatString: '%s'}}
                                       }
-                                }""" % (json.dumps(data_labels), json.dumps(data_labels))
+                                }""" % (json.dumps(data_labels), json.dumps(data_labels), value_format)
                 elif graph_type == 'PieChart':
                     table = [list(zip(data_labels, data))]
                     extra = """{seriesDefaults: {renderer: jQuery.jqplot.PieRenderer,
@@ -0,0 +1,350 @@
+# -*- encoding: utf-8 -*-
+"""
+Background exports.
+
+When ``settings.ADMINACTIONS_EXPORT_ASYNC`` is True the export actions do not produce
+the file inside the admin request: the export is enqueued as an :class:`ExportJob`,
+executed by the configured executor and the result is stored using Django storage.
+
+The state of each job is saved, as json, next to its result so any process
+(thread, Celery/RQ worker...) sharing the same storage can run it. Jobs store the
+SQL that selects the records to export, signed with ``SECRET_KEY``, never pickled objects.
+"""
+from __future__ import absolute_import, unicode_literals
+import datetime
+import importlib
+import io
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+import uuid
+import six
+from six.moves import queue
+from django.conf import settings
+from django.core.files import File
+from django.core.files.base import ContentFile
+from django.core import signing
+from django.core.files.storage import FileSystemStorage, get_storage_class
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections
+from django.db.models.sql.datastructures import EmptyResultSet
+from adminactions import compat
+from adminactions.api import export_as_csv
+from adminactions.signals import adminaction_end
+
+logger = logging.getLogger(__name__)
+
+
+def import_by_path(dotted_path):
+    module_name, attr = dotted_path.rsplit('.', 1)
+    return getattr(importlib.import_module(module_name), attr)
+
+
+QUERY_SALT = 'adminactions.jobs.query'
+
+# minimum number of seconds between two writes of the progress of a job
+PROGRESS_INTERVAL = 1
+
+# atomic rename over an existing file (os.rename on python 2)
+_replace = getattr(os, 'replace', os.rename)
+
+
+def get_storage():
+    """
+    returns the storage used to save jobs and results:
+    ``settings.ADMINACTIONS_EXPORT_STORAGE`` or a FileSystemStorage in
+    ``settings.ADMINACTIONS_EXPORT_ROOT``, that must not be served by the web server
+    """
+    storage_class = getattr(settings, 'ADMINACTIONS_EXPORT_STORAGE', None)
+    if storage_class:
+        return get_storage_class(storage_class)()
+    root = getattr(settings, 'ADMINACTIONS_EXPORT_ROOT', os.path.join(tempfile.gettempdir(), 'adminactions'))
+    return FileSystemStorage(location=root)
+
+
+class SyncExecutor(object):
+    """
+    runs the job immediately in the current thread. Useful for debugging and tests
+    """
+
+    def submit(self, fn, *args, **kwargs):
+        fn(*args, **kwargs)
+
+
+class ThreadPoolExecutor(object):
+    """
+    minimal pool of daemon threads that run the submitted callables in order
+    """
+
+    def __init__(self, max_workers=2):
+        self.max_workers = max_workers
+        self._queue = queue.Queue()
+        self._workers = []
+        self._lock = threading.Lock()
+
+    def submit(self, fn, *args, **kwargs):
+        with self._lock:
+            if len(self._workers) < self.max_workers:
+                worker = threading.Thread(target=self._work)
+                worker.daemon = True
+                worker.start()
+                self._workers.append(worker)
+        self._queue.put((fn, args, kwargs))
+
+    def _work(self):
+        while True:
+            fn, args, kwargs = self._queue.get()
+            try:
+                fn(*args, **kwargs)
+            except Exception:
+                logger.exception('Error running %s' % fn)
+            finally:
+                compat.close_old_connections()
+                self._queue.task_done()
+
+
+default_executor = ThreadPoolExecutor()
+
+
+def get_executor():
+    """
+    returns the executor used to run the jobs.
+
+    ``settings.ADMINACTIONS_EXPORT_EXECUTOR`` can be the dotted path of any object
+    (or class) that implements ``submit(fn, *args, **kwargs)``. ``fn`` is always
+    :func:`run_export_job` and ``args`` only the job id, so the executor can
+    easily forward it to Celery, RQ...
+    """
+    path = getattr(settings, 'ADMINACTIONS_EXPORT_EXECUTOR', None)
+    if not path:
+        return default_executor
+    executor = import_by_path(path)
+    if isinstance(executor, six.class_types):
+        executor = executor()
+    return executor
+
+
+class ExportJob(object):
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+
+    def __init__(self, **kwargs):
+        self.id = uuid.uuid4().hex
+        self.status = self.PENDING
+        self.user = None
+        self.created = datetime.datetime.utcnow().isoformat()
+        self.action = None
+        self.impl = None
+        self.app_label = None
+        self.model = None
+        self.db = None
+        self.query = None
+        self.ordering = None
+        self.fields = None
+        self.header = False
+        self.filename = None
+        self.options = {}
+        self.total = None
+        self.processed = 0
+        self.error = None
+        self.result = None
+        self.__dict__.update(kwargs)
+
+    @staticmethod
+    def get_path(job_id):
+        path = getattr(settings, 'ADMINACTIONS_EXPORT_JOBS_PATH', 'adminactions/exports')
+        return '%s/%s' % (path.rstrip('/'), job_id)
+
+    @property
+    def status_file(self):
+        return '%s.json' % self.get_path(self.id)
+
+    @property
+    def finished(self):
+        return self.status in (self.DONE, self.FAILED)
+
+    @property
+    def percent(self):
+        if not self.total:
+            return 100 if self.status == self.DONE else 0
+        return min(100, int(self.processed * 100 / self.total))
+
+    @classmethod
+    def load(cls, job_id):
+        storage = get_storage()
+        f = storage.open('%s.json' % cls.get_path(job_id))
+        try:
+            return cls(**json.loads(f.read().decode('utf8')))
+        finally:
+            f.close()
+
+    def save(self):
+        """
+        writes the state of the job. With storages that have local files the state is written
+        in a temporary file renamed over the old one, so readers never see a partial file
+        """
+        storage = get_storage()
+        content = json.dumps(self.__dict__, cls=DjangoJSONEncoder).encode('utf8')
+        try:
+            path = storage.path(self.status_file)
+        except NotImplementedError:
+            if storage.exists(self.status_file):
+                storage.delete(self.status_file)
+            storage.save(self.status_file, ContentFile(content))
+            return
+        dirname = os.path.dirname(path)
+        if not os.path.isdir(dirname):
+            try:
+                os.makedirs(dirname)
+            except OSError:
+                # created by another process
+                if not os.path.isdir(dirname):
+                    raise
+        fd, tmp = tempfile.mkstemp(dir=dirname, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(content)
+            _replace(tmp, path)
+        except Exception:
+            os.remove(tmp)
+            raise
+
+    def get_queryset(self):
+        """
+        returns the records selected by the stored (signed) SQL, as a subquery:
+        the size of the query does not depend on the number of records
+        """
+        model = compat.get_model(self.app_label, self.model)
+        queryset = model._default_manager.using(self.db)
+        query = signing.loads(self.query, salt=QUERY_SALT)
+        if query is None:
+            return queryset.none()
+        qn = connections[self.db].ops.quote_name
+        pk = '%s.%s' % (qn(model._meta.db_table), qn(model._meta.pk.column))
+        return queryset.extra(where=['%s IN (%s)' % (pk, query['sql'])],
+                              params=query['params']).order_by(*self.ordering)
+
+    def run(self):
+        self.status = self.RUNNING
+        self.save()
+        queryset = self.get_queryset()
+        self.total = queryset.count()
+        self.save()
+
+        last_save = [time.time()]
+
+        def progress(processed):
+            # the status is written at most every PROGRESS_INTERVAL seconds
+            self.processed = processed
+            if time.time() - last_save[0] >= PROGRESS_INTERVAL:
+                self.save()
+                last_save[0] = time.time()
+
+        impl = import_by_path(self.impl)
+        options = dict(self.options, progress=progress)
+        tmp = tempfile.TemporaryFile()
+        try:
+            out = tmp
+            if six.PY3 and impl is export_as_csv:
+                # python3 csv module writes text
+                out = io.TextIOWrapper(tmp, encoding='utf-8', newline='')
+            impl(queryset, fields=self.fields, header=self.header,
+                 filename=self.filename, options=options, out=out)
+            if out is not tmp:
+                out.flush()
+                out.detach()
+            tmp.seek(0)
+            self.result = get_storage().save('%s/%s' % (self.get_path(self.id), self.filename), File(tmp))
+        finally:
+            tmp.close()
+        self.processed = self.total
+        self.status = self.DONE
+        self.save()
+
+
+def run_export_job(job_id):
+    """
+    executes the export described by the job ``job_id`` and sends ``adminaction_end``.
+    The signal is sent by the executor, so ``request``, ``modeladmin`` and ``form`` are None
+    """
+    job = ExportJob.load(job_id)
+    errors = []
+    try:
+        job.run()
+    except Exception as e:
+        logger.exception('Export %s failed' % job_id)
+        errors.append(e)
+        job.status = ExportJob.FAILED
+        job.error = six.text_type(e)
+        job.save()
+    adminaction_end.send(sender=compat.get_model(job.app_label, job.model),
+                         action=job.action,
+                         request=None,
+                         queryset=job.get_queryset(),
+                         modeladmin=None,
+                         form=None,
+                         errors=errors,
+                         updated=job.processed,
+                         job=job)
+    return job
+
+
+def _get_query(queryset):
+    """
+    returns the signed SQL (and params) that selects the primary keys of ``queryset``
+    """
+    query = queryset.values('pk').order_by().query
+    try:
+        sql, params = query.get_compiler(using=queryset.db).as_sql()
+    except EmptyResultSet:
+        return signing.dumps(None, salt=QUERY_SALT)
+    params = json.loads(json.dumps(list(params), cls=DjangoJSONEncoder))
+    return signing.dumps({'sql': sql, 'params': params}, salt=QUERY_SALT)
+
+
+def _get_ordering(queryset):
+    query = queryset.query
+    if query.extra_order_by:
+        return []
+    ordering = query.order_by or (query.default_ordering and queryset.model._meta.ordering) or []
+    return [o for o in ordering if isinstance(o, six.string_types)]
+
+
+def enqueue_export(impl, queryset, filename, fields=None, header=False, options=None, user=None, action=None):
+    """
+    creates an :class:`ExportJob` that will run ``impl`` (one of the exporters of
+    :mod:`adminactions.api`) over ``queryset`` and submit it to the executor.
+    The job stores the SQL of ``queryset`` and its ordering: records are selected
+    when the job runs
+
+    :param impl: exporter function
+    :param queryset: queryset to export
+    :param filename: name of the result file
+    :param fields: list of fields names to export. None for all fields
+    :param header: see ``impl``
+    :param options: see ``impl``. Must be json serializable
+    :param user: user that requested the export
+    :param action: name of the admin action, sent with ``adminaction_end``
+    :return: ExportJob
+    """
+    opts = queryset.model._meta
+    job = ExportJob(impl='%s.%s' % (impl.__module__, impl.__name__),
+                    action=action,
+                    user=getattr(user, 'pk', None),
+                    app_label=opts.app_label,
+                    model=opts.object_name,
+                    db=queryset.db,
+                    query=_get_query(queryset),
+                    ordering=_get_ordering(queryset),
+                    fields=list(fields) if fields else None,
+                    header=header,
+                    filename=filename,
+                    options=dict(options or {}))
+    job.save()
+    get_executor().submit(run_export_job, job.id)
+    return job
@@ -19,6 +19,8 @@ else:
 
 from collections import defaultdict
 from django import forms
+from django.conf import settings
+from django.db import connections
 from django.db.models import fields as df
 from django.forms import fields as ff
 from django.forms.models import modelform_factory, ModelMultipleChoiceField, construct_instance, InlineForeignKeyField
@@ -34,6 +36,13 @@ from django.utils.safestring import mark_safe
 from django.utils.translation import ugettext as _
 from adminactions import compat
 
+try:
+    from django.db.models import Case, F, Value, When
+    from django.db.models.functions import Lower, Upper
+except ImportError:
+    # Django < 1.8
+    Case = None
+
 from adminactions.models import get_permission_codename
 from adminactions.exceptions import ActionInterrupted
 from adminactions.forms import GenericActionForm
@@ -52,6 +61,19 @@ trim = lambda arg, value: value.strip(arg)
 change_domain = lambda arg, value: re.sub('@.*', arg, value)
 change_protocol = lambda arg, value: re.sub('^[a-z]*://', "%s://" % arg, value)
 
+# SQL equivalents of the operators, used by `queryset.update()` when 'validate' is not set.
+# Only operators that give the same result on every backend: 'trim' (whitespace characters)
+# and the percentages (rounding) are applied by python.
+# :param name the name of the field
+# :param arg is the value set in the MassUpdateForm (only if the operator allows it)
+add_sql = lambda name, arg: F(name) + arg
+sub_sql = lambda name, arg: F(name) - arg
+negate_sql = lambda name: Case(When(**{name: True}, then=Value(False)),
+                               default=Value(True), output_field=df.NullBooleanField())
+upper_sql = lambda name: Upper(name)
+lower_sql = lambda name: Lower(name)
+null_sql = lambda name: None
+
 disable_if_not_nullable = lambda field: field.null
 disable_if_unique = lambda field: not field.unique
 
@@ -71,18 +93,48 @@ class OperationManager(object):
             specific field. i.e. disable 'set null` if the field cannot be null, or disable `set` if
             the field is unique
     description: string description of the operator
+    expression: (optional) callable that accepts the field name (and the argument if `param_allowed`)
+            and returns the SQL expression equivalent to `function`, so that the operator can be applied
+            with a single `queryset.update()`. i.e. `lambda name, arg: F(name) + arg`
     """
 
     COMMON = [('set', (None, True, disable_if_unique, "")),
-              ('set null', (lambda old_value: None, False, disable_if_not_nullable, ""))]
+              ('set null', (lambda old_value: None, False, disable_if_not_nullable, "", null_sql))]
 
     def __init__(self, _dict):
         self._dict = dict()
+        self._expressions = dict()
         for field_class, args in list(_dict.items()):
-            self._dict[field_class] = SortedDict(self.COMMON + args)
+            self._dict[field_class] = self._register(field_class, self.COMMON + args)
+        self._common = self._register(None, self.COMMON)
+
+    def _register(self, field_class, operators):
+        ret = SortedDict()
+        for label, args in operators:
+            ret[label] = args[:4]
+            if len(args) > 4:
+                self._expressions[(field_class, label)] = args[4]
+        return ret
+
+    def register(self, field_class, label, operation):
+        """ adds the operation `label` for `field_class`
+            :param operation tuple (function, param_allowed, enabler, description[, expression])
+        """
+        operators = self._dict.setdefault(field_class, self._register(field_class, self.COMMON))
+        operators.update(self._register(field_class, [(label, operation)]))
 
     def get(self, field_class, d=None):
-        return self._dict.get(field_class, SortedDict(self.COMMON))
+        return self._dict.get(field_class, self._common)
+
+    def get_expression(self, field, label):
+        """ returns the SQL expression factory of the operator `label` for passed field
+            :param field Field django Model Field
+            :return callable or None if the operator cannot be translated to SQL
+        """
+        if Case is None:
+            return None
+        field_class = field.__class__ if field.__class__ in self._dict else None
+        return self._expressions.get((field_class, label))
 
     def get_for_field(self, field):
         """ returns valid functions for passed field
@@ -101,18 +153,18 @@ class OperationManager(object):
 
 
 OPERATIONS = OperationManager({
-    df.CharField: [('upper', (string.upper, False, True, "convert to uppercase")),
-                   ('lower', (string.lower, False, True, "convert to lowercase")),
+    df.CharField: [('upper', (string.upper, False, True, "convert to uppercase", upper_sql)),
+                   ('lower', (string.lower, False, True, "convert to lowercase", lower_sql)),
                    ('capitalize', (string.capitalize, False, True, "capitalize first character")),
                    # ('capwords', (string.capwords, False, True, "capitalize each word")),
                    # ('swapcase', (string.swapcase, False, True, "")),
                    ('trim', (string.strip, False, True, "leading and trailing whitespace"))],
     df.IntegerField: [('add percent', (add_percent, True, True, "add <arg> percent to existing value")),
                       ('sub percent', (sub_percent, True, True, "")),
-                      ('sub', (sub_percent, True, True, "")),
-                      ('add', (add, True, True, ""))],
-    df.BooleanField: [('swap', (negate, False, True, ""))],
-    df.NullBooleanField: [('swap', (negate, False, True, ""))],
+                      ('sub', (sub, True, True, "", sub_sql)),
+                      ('add', (add, True, True, "", add_sql))],
+    df.BooleanField: [('swap', (negate, False, True, "", negate_sql))],
+    df.NullBooleanField: [('swap', (negate, False, True, "", negate_sql))],
     df.EmailField: [('change domain', (change_domain, True, True, ""))],
     df.URLField: [('change protocol', (change_protocol, True, True, ""))]
 })
@@ -126,6 +178,10 @@ class MassUpdateForm(GenericActionForm):
 
     _validate = forms.BooleanField(label='Validate',
                                    help_text="if checked use obj.save() instead of manager.update()")
+    _bulk = forms.BooleanField(label='Bulk',
+                               required=False,
+                               help_text="if checked (with 'Validate') records are updated in chunks, "
+                                         "with one statement for each chunk. obj.save() is not called")
     # _unique_transaction = forms.BooleanField(label='Unique transaction',
     # required=False,
     # help_text="If checked create one transaction for the whole update. "
@@ -134,6 +190,7 @@ class MassUpdateForm(GenericActionForm):
     def __init__(self, *args, **kwargs):
         super(MassUpdateForm, self).__init__(*args, **kwargs)
         self._errors = None
+        self.expressions = {}
 
     # def is_valid(self):
     #    return super(MassUpdateForm, self).is_valid()
@@ -176,11 +233,16 @@ class MassUpdateForm(GenericActionForm):
                         value = field.clean(raw_value)
                         if function:
                             func, hasparm, __, __ = OPERATIONS.get_for_field(field_object)[function]
+                            expression = OPERATIONS.get_expression(field_object, function)
                             if func is None:
                                 pass
                             elif hasparm:
+                                if expression:
+                                    self.expressions[name] = expression(name, value)
                                 value = curry(func, value)
                             else:
+                                if expression:
+                                    self.expressions[name] = expression(name)
                                 value = func
 
                         self.cleaned_data[name] = value
@@ -201,6 +263,116 @@ class MassUpdateForm(GenericActionForm):
     def clean__clean(self):
         return bool(self.data.get('_clean', 0))
 
+    def clean__bulk(self):
+        return bool(self.data.get('_bulk', 0))
+
+
+def get_mass_update_chunk_size():
+    """
+    returns the number of records updated by each statement of the bulk mode:
+    ``settings.ADMINACTIONS_MASS_UPDATE_CHUNK_SIZE`` (default: 100)
+    """
+    return getattr(settings, 'ADMINACTIONS_MASS_UPDATE_CHUNK_SIZE', 100)
+
+
+def get_mass_update_sample_size():
+    """
+    returns the number of records read to show the existing values in the mass update form:
+    ``settings.ADMINACTIONS_MASS_UPDATE_SAMPLE_SIZE`` (default: 10)
+    """
+    return getattr(settings, 'ADMINACTIONS_MASS_UPDATE_SAMPLE_SIZE', 10)
+
+
+def get_sample_values(queryset, fields, size):
+    """
+    returns a dict of the distinct values of `fields` in the first `size` records of `queryset`.
+
+    Fields with choices and boolean fields return all the possible values.
+    Only the sampled columns are read, with a single query;
+    ForeignKeys are represented with the text of the related object.
+
+    :param queryset: queryset to sample
+    :param fields: list of model fields
+    :param size: number of records to read
+    :return: dict field name => list of values
+    """
+    ret = {}
+    sampled = []
+    for f in fields:
+        choices = getattr(f, 'flatchoices', None) or getattr(f, 'choices', None)
+        if choices:
+            ret[f.name] = list(dict(choices).values())
+        elif isinstance(f, df.BooleanField):
+            ret[f.name] = [True, False]
+        else:
+            sampled.append(f)
+    if not sampled or not size:
+        return ret
+
+    values = dict((f.attname, []) for f in sampled)
+    seen = dict((f.attname, set()) for f in sampled)
+    for row in queryset.values(*list(values.keys()))[:size]:
+        for attname, value in row.items():
+            if value is None:
+                continue
+            try:
+                if value in seen[attname]:
+                    continue
+                seen[attname].add(value)
+            except TypeError:  # unhashable, ie. BinaryField
+                if value in values[attname]:
+                    continue
+            values[attname].append(value)
+
+    for f in sampled:
+        value = values[f.attname]
+        if f.rel and value:
+            to_field = f.rel.get_related_field().attname
+            related = dict((getattr(o, to_field), o)
+                           for o in f.rel.to._default_manager.filter(**{'%s__in' % to_field: value}))
+            value = [smart_text(related[pk]) for pk in value if pk in related]
+        ret[f.name] = value
+    return ret
+
+
+def bulk_update(queryset, records, field_names):
+    """
+    saves `field_names` of `records` with a single UPDATE statement.
+    obj.save() is not called so no signals are sent
+
+    :param queryset: queryset records belong to
+    :param records: list of model instances
+    :param field_names: names of the fields to save
+    :return: number of updated records
+    """
+    opts = queryset.model._meta
+    fields = [opts.get_field_by_name(name)[0] for name in field_names]
+    if Case is None:
+        for record in records:
+            queryset.filter(pk=record.pk).update(**dict((f.name, getattr(record, f.attname)) for f in fields))
+        return len(records)
+
+    values = {}
+    for field in fields:
+        values[field.name] = Case(*[When(pk=record.pk,
+                                         then=Value(getattr(record, field.attname), output_field=field))
+                                    for record in records],
+                                  output_field=field)
+    return queryset.filter(pk__in=[record.pk for record in records]).order_by().update(**values)
+
+
+def chunked(queryset, chunk_size):
+    """
+    yields the records of `queryset` in lists of `chunk_size` elements.
+
+    Primary keys are read once at the beginning, so records are always
+    fetched by pk even if the update changes the queryset ordering or filters
+    """
+    pks = list(queryset.order_by().values_list('pk', flat=True))
+    base = queryset.model._default_manager.using(queryset.db)
+    for i in range(0, len(pks), chunk_size):
+        yield list(base.filter(pk__in=pks[i:i + chunk_size]))
+
 
 def mass_update(modeladmin, request, queryset):  # noqa
     """
@@ -212,20 +384,43 @@ def mass_update(modeladmin, request, queryset):  # noqa
         kwargs['required'] = False
         return field.formfield(**kwargs)
 
+    def _apply(record, field_names):
+        for field_name in field_names:
+            value_or_func = form.cleaned_data[field_name]
+            if callable(value_or_func):
+                old_value = getattr(record, field_name)
+                setattr(record, field_name, value_or_func(old_value))
+            else:
+                setattr(record, field_name, value_or_func)
+        if clean:
+            record.clean()
+
     def _doit():
         errors = {}
         updated = 0
         for record in queryset:
-            for field_name, value_or_func in list(form.cleaned_data.items()):
-                if callable(value_or_func):
-                    old_value = getattr(record, field_name)
-                    setattr(record, field_name, value_or_func(old_value))
-                else:
-                    setattr(record, field_name, value_or_func)
-            if clean:
-                record.clean()
+            _apply(record, list(form.cleaned_data.keys()))
             record.save()
             updated += 1
+        _done(errors, updated)
+
+    def _doit_bulk():
+        errors = {}
+        updated = 0
+        field_names = [f.name for f in form.model_fields() if f.name in form.cleaned_data]
+        chunk_size = get_mass_update_chunk_size()
+        if field_names:
+            # some backends (ie. sqlite) limit the number of parameters of each statement
+            ops = connections[queryset.db].ops
+            chunk_size = min(chunk_size, ops.bulk_batch_size(['pk'] + field_names * 2, [None] * chunk_size))
+            for records in chunked(queryset, max(chunk_size, 1)):
+                with compat.atomic(using=queryset.db):
+                    for record in records:
+                        _apply(record, field_names)
+                    updated += bulk_update(queryset, records, field_names)
+        _done(errors, updated)
+
+    def _done(errors, updated):
         if updated:
             messages.info(request, _("Updated %s records") % updated)
 
@@ -286,7 +481,16 @@ def mass_update(modeladmin, request, queryset):  # noqa
             validate = form.cleaned_data.get('_validate', False)
             clean = form.cleaned_data.get('_clean', False)
 
-            if validate:
+            bulk = form.cleaned_data.get('_bulk', False)
+
+            if validate and bulk:
+                for field_name in form.cleaned_data:
+                    if isinstance(form.fields[field_name], ModelMultipleChoiceField):
+                        messages.error(request, "Unable no mass update ManyToManyField using 'bulk'")
+                        return HttpResponseRedirect(request.get_full_path())
+                _doit_bulk()
+
+            elif validate:
                 with compat.atomic():
                     _doit()
 
@@ -297,10 +501,12 @@ def mass_update(modeladmin, request, queryset):  # noqa
                         messages.error(request, "Unable no mass update ManyToManyField without 'validate'")
                         return HttpResponseRedirect(request.get_full_path())
                     elif callable(value):
-                        messages.error(request, "Unable no mass update using operators without 'validate'")
-                        return HttpResponseRedirect(request.get_full_path())
+                        if field_name not in form.expressions:
+                            messages.error(request, "Unable no mass update using operators without 'validate'")
+                            return HttpResponseRedirect(request.get_full_path())
+                        values[field_name] = form.expressions[field_name]
                     elif field_name not in ['_selected_action', '_validate', 'select_across', 'action',
-                                            '_unique_transaction', '_clean']:
+                                            '_unique_transaction', '_clean', '_bulk']:
                         values[field_name] = value
                 queryset.update(**values)
 
@@ -318,20 +524,8 @@ def mass_update(modeladmin, request, queryset):  # noqa
 
         form = MForm(initial=initial, instance=prefill_instance)
 
-    for el in queryset.all()[:10]:
-        for f in modeladmin.model._meta.fields:
-            if f.name not in form._no_sample_for:
-                if hasattr(f, 'flatchoices') and f.flatchoices:
-                    grouped[f.name] = list(dict(getattr(f, 'flatchoices')).values())
-                elif hasattr(f, 'choices') and f.choices:
-                    grouped[f.name] = list(dict(getattr(f, 'choices')).values())
-                elif isinstance(f, df.BooleanField):
-                    grouped[f.name] = [True, False]
-                else:
-                    value = getattr(el, f.name)
-                    if value is not None and value not in grouped[f.name]:
-                        grouped[f.name].append(value)
-                    initial[f.name] = initial.get(f.name, value)
+    sampled = [f for f in modeladmin.model._meta.fields if f.name not in form._no_sample_for]
+    grouped.update(get_sample_values(queryset, sampled, get_mass_update_sample_size()))
 
     adminForm = helpers.AdminForm(form, modeladmin.get_fieldsets(request), {}, [], model_admin=modeladmin)
     media = modeladmin.media + adminForm.media
@@ -6,8 +6,9 @@ from adminactions import api
 from django.contrib import messages
 from django.contrib.admin import helpers
 from django import forms
+from django.core.exceptions import NON_FIELD_ERRORS, ValidationError
 from django.forms import TextInput, HiddenInput
-from django.db import models
+from django.db import connections, models
 from django.forms.formsets import formset_factory
 from django.forms.models import modelform_factory, model_to_dict
 from django.shortcuts import render_to_response
@@ -18,7 +19,6 @@ from django.utils.translation import gettext as _
 from adminactions.forms import GenericActionForm
 from adminactions.models import get_permission_codename
 from adminactions.utils import clone_instance
-import adminactions.compat as transaction
 
 
 class MergeForm(GenericActionForm):
@@ -39,19 +39,70 @@ class MergeForm(GenericActionForm):
 
     master_pk = forms.CharField(widget=HiddenInput)
     other_pk = forms.CharField(widget=HiddenInput)
+    extra_pks = forms.CharField(required=False, widget=HiddenInput)
     field_names = forms.CharField(required=False, widget=HiddenInput)
 
     def action_fields(self):
-        for fieldname in ['dependencies', 'master_pk', 'other_pk', 'field_names']:
+        for fieldname in ['dependencies', 'master_pk', 'other_pk', 'extra_pks', 'field_names']:
             bf = self[fieldname]
             yield HiddenInput().render(fieldname, bf.value())
 
     def clean_dependencies(self):
         return int(self.cleaned_data['dependencies'])
 
+    def clean_extra_pks(self):
+        return [pk for pk in self.cleaned_data['extra_pks'].split(',') if pk]
+
     def clean_field_names(self):
         return self.cleaned_data['field_names'].split(',')
 
+    def get_merged_pks(self):
+        """
+        primary keys of the records that disappear with the merge: they cannot
+        conflict with the new values of master
+        """
+        return [self.instance.pk, self.cleaned_data.get('other_pk')] + self.cleaned_data.get('extra_pks', [])
+
+    def validate_unique(self):
+        """
+        checks the unique constraints (and unique_for_date/month/year) of master against
+        the records that are not part of the merge, with one `exists()` query for each constraint
+        """
+        instance = self.instance
+        opts = instance._meta
+        unique_checks, date_checks = instance._get_unique_checks(exclude=self._get_validation_exclusions())
+        merged_pks = self.get_merged_pks()
+        errors = {}
+        for model_class, unique_check in unique_checks:
+            qs = model_class._default_manager.exclude(pk__in=merged_pks)
+            lookup = {}
+            for field_name in unique_check:
+                f = opts.get_field(field_name)
+                value = getattr(instance, f.attname)
+                if value is None or (value == '' and connections[qs.db].features.interprets_empty_strings_as_nulls):
+                    break
+                lookup[str(field_name)] = value
+            else:
+                if qs.filter(**lookup).exists():
+                    key = unique_check[0] if len(unique_check) == 1 else NON_FIELD_ERRORS
+                    errors.setdefault(key, []).append(instance.unique_error_message(model_class, unique_check))
+        # see django.db.models.Model._perform_date_checks()
+        for model_class, lookup_type, field, unique_for in date_checks:
+            date = getattr(instance, unique_for)
+            if date is None:
+                continue
+            if lookup_type == 'date':
+                lookup = {'%s__day' % unique_for: date.day,
+                          '%s__month' % unique_for: date.month,
+                          '%s__year' % unique_for: date.year}
+            else:
+                lookup = {'%s__%s' % (unique_for, lookup_type): getattr(date, lookup_type)}
+            lookup[field] = getattr(instance, field)
+            if model_class._default_manager.filter(**lookup).exclude(pk__in=merged_pks).exists():
+                errors.setdefault(field, []).append(instance.date_error_message(lookup_type, field, unique_for))
+        if errors:
+            self._update_errors(ValidationError(errors))
+
     def full_clean(self):
         super(MergeForm, self).full_clean()
 
@@ -68,7 +119,7 @@ class MergeForm(GenericActionForm):
 
 def merge(modeladmin, request, queryset):  # noqa
     """
-    Merge two model instances. Move all foreign keys.
+    Merge two (or more) model instances. Move all foreign keys.
 
     """
 
@@ -104,45 +155,53 @@ def merge(modeladmin, request, queryset):  # noqa
         'result': '',
         'opts': queryset.model._meta}
 
+    def get_records():
+        # master, other and extra records with a single query
+        pk = queryset.model._meta.pk
+        master_pk = pk.to_python(request.POST.get('master_pk'))
+        other_pk = pk.to_python(request.POST.get('other_pk'))
+        extra_pks = [pk.to_python(value) for value in request.POST.get('extra_pks', '').split(',') if value]
+        records = queryset.in_bulk([master_pk, other_pk] + extra_pks)
+        if master_pk not in records or other_pk not in records:
+            raise queryset.model.DoesNotExist()
+        extra = [records[value] for value in extra_pks if value in records and value not in (master_pk, other_pk)]
+        return records[master_pk], records[other_pk], extra
+
     if 'preview' in request.POST:
-        master = queryset.get(pk=request.POST.get('master_pk'))
+        master, other, extra = get_records()
         original = clone_instance(master)
-        other = queryset.get(pk=request.POST.get('other_pk'))
         formset = formset_factory(OForm)(initial=[model_to_dict(master), model_to_dict(other)])
-        with transaction.nocommit():
-            form = MForm(request.POST, instance=master)
-            other.delete()
-            form_is_valid = form.is_valid()
-        if form_is_valid:
+        form = MForm(request.POST, instance=master)
+        if form.is_valid():
             ctx.update({'original': original})
             tpl = 'adminactions/merge_preview.html'
         else:
-            master = queryset.get(pk=request.POST.get('master_pk'))
-            other = queryset.get(pk=request.POST.get('other_pk'))
+            # the form has already updated master
+            master = original
 
     elif 'apply' in request.POST:
-        master = queryset.get(pk=request.POST.get('master_pk'))
-        other = queryset.get(pk=request.POST.get('other_pk'))
+        master, other, extra = get_records()
         formset = formset_factory(OForm)(initial=[model_to_dict(master), model_to_dict(other)])
-        with transaction.nocommit():
-            form = MForm(request.POST, instance=master)
-            stored_pk = other.pk
-            other.delete()
-            ok = form.is_valid()
-            other.pk = stored_pk
-        if ok:
+        form = MForm(request.POST, instance=master)
+        if form.is_valid():
             if form.cleaned_data['dependencies'] == MergeForm.DEP_MOVE:
                 related = api.ALL_FIELDS
             else:
                 related = None
             fields = form.cleaned_data['field_names']
-            api.merge(master, other, fields=fields, commit=True, related=related)
+            try:
+                api.merge_many(master, [other] + extra, fields=fields, commit=True, related=related)
+            except ValueError as e:
+                messages.error(request, str(e))
             return HttpResponseRedirect(request.path)
         else:
             messages.error(request, form.errors)
     else:
         try:
-            master, other = queryset.all()
+            records = list(queryset.all())
+            if len(records) < 2:
+                raise ValueError()
+            master, other, extra = records[0], records[1], records[2:]
             # django 1.4 need to remove the trailing milliseconds
             for field in master._meta.fields:
                 if isinstance(field, models.DateTimeField):
@@ -152,7 +211,7 @@ def merge(modeladmin, request, queryset):  # noqa
                                                raw_value.hour, raw_value.minute, raw_value.second)
                         setattr(target, field.name, fixed_value)
         except ValueError:
-            messages.error(request, _('Please select exactly 2 records'))
+            messages.error(request, _('Please select at least 2 records'))
             return
 
         initial = {'_selected_action': request.POST.getlist(helpers.ACTION_CHECKBOX_NAME),
@@ -161,7 +220,8 @@ def merge(modeladmin, request, queryset):  # noqa
                    'dependencies': MergeForm.DEP_MOVE,
                    'action': 'merge',
                    'master_pk': master.pk,
-                   'other_pk': other.pk}
+                   'other_pk': other.pk,
+                   'extra_pks': ','.join([smart_text(record.pk) for record in extra])}
         formset = formset_factory(OForm)(initial=[model_to_dict(master), model_to_dict(other)])
         form = MForm(initial=initial, instance=master)
 
@@ -172,7 +232,8 @@ def merge(modeladmin, request, queryset):  # noqa
                 'media': mark_safe(media),
                 'title': u"Merge %s" % smart_text(modeladmin.opts.verbose_name_plural),
                 'master': master,
-                'other': other})
+                'other': other,
+                'extra': extra})
     return render_to_response(tpl, RequestContext(request, ctx))
 
 
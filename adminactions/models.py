@@ -43,3 +43,8 @@ try:
     signals.post_migrate.connect(create_extra_permission)
 except:
     signals.post_syncdb.connect(create_extra_permission)
+
+    # Django < 1.7 has no AppConfig.ready()
+    from adminactions.graph import connect_graph_cache
+
+    connect_graph_cache()
@@ -1,7 +1,11 @@
 from __future__ import absolute_import, unicode_literals
 from django.conf.urls import patterns, url
-from adminactions.views import format_date
+from adminactions.views import format_date, export_status, export_download
 
 
 urlpatterns = patterns('',
-                       url(r'^s/format/date/$', format_date, name='adminactions.format_date'))
+                       url(r'^s/format/date/$', format_date, name='adminactions.format_date'),
+                       url(r'^export/(?P<job_id>[0-9a-f]{32})/$', export_status,
+                           name='adminactions.export_status'),
+                       url(r'^export/(?P<job_id>[0-9a-f]{32})/download/$', export_download,
+                           name='adminactions.export_download'))
@@ -1,6 +1,13 @@
 from __future__ import absolute_import, unicode_literals
+import operator
+import re
+import unicodedata
+import uuid
+import django
 import six
+from django.conf import settings
 from django.db import models
+from django.db.models.fields import FieldDoesNotExist
 # from django.db.models.fields.related import ForeignKey
 from django.db.models.query import QuerySet
 from django.db import connections, router
@@ -123,6 +130,272 @@ def get_field_value(obj, field, usedisplay=True, raw_callable=False):
     return value
 
 
+_accessors_cache = {}
+_ACCESSORS_CACHE_SIZE = 256
+
+
+def _get_field_accessor(target, fieldname, usedisplay, raw_callable):
+    """
+    resolve once how ``fieldname`` must be read from instances of ``target``
+    and returns a callable that behaves like :func:`get_field_value`
+    """
+    display = 'get_%s_display' % fieldname
+    call = not raw_callable
+    if usedisplay and hasattr(target, display):
+        getter = operator.methodcaller(display)
+        call = False
+    elif issubclass(target, dict):
+        if hasattr(target, fieldname):
+            getter = None
+        else:
+            getter = operator.itemgetter(fieldname)
+    else:
+        getter = operator.attrgetter(fieldname)
+        if issubclass(target, models.Model) and fieldname in [f.name for f in target._meta.fields]:
+            # concrete field: value is never a callable
+            call = False
+
+    def accessor(obj):
+        if getter is None:
+            return get_field_value(obj, fieldname, usedisplay=usedisplay, raw_callable=raw_callable)
+        try:
+            value = getter(obj)
+        except Exception:
+            # let the generic lookup handle (or raise) anything unexpected
+            return get_field_value(obj, fieldname, usedisplay=usedisplay, raw_callable=raw_callable)
+        if call and callable(value):
+            value = value()
+        if isinstance(value, models.Model):
+            return smart_text(value)
+        if isinstance(value, six.string_types):
+            value = smart_text(value)
+        return value
+
+    return accessor
+
+
+def get_field_accessors(obj, fields, usedisplay=True, raw_callable=False):
+    """
+    returns a list of callables, one for each entry of ``fields``, that extract
+    the value of that field from objects of the same class of ``obj``.
+
+    Each callable returns the same value of :func:`get_field_value`, but all the
+    introspection (display methods, dotted paths, callables) is done once
+    per (class, fields, usedisplay, raw_callable) instead of once per value.
+
+    :param obj: :class:`django.db.models.Model` instance, dict or any object
+    :param fields: list of field names. Can use dot notation
+    :param usedisplay: boolean if True use the get_FIELD_display() result
+    :param raw_callable: boolean if False callable values are invoked
+    :return: list of callables
+
+    >>> from django.contrib.auth.models import Permission
+    >>> p = Permission(name='perm', codename='code')
+    >>> [accessor(p) for accessor in get_field_accessors(p, ['name', 'codename'])]
+    [u'perm', u'code']
+    """
+    fields = tuple(f.name if isinstance(f, models.Field) else f for f in fields)
+    key = (obj.__class__, fields, usedisplay, raw_callable)
+    try:
+        return _accessors_cache[key]
+    except KeyError:
+        pass
+    accessors = [_get_field_accessor(obj.__class__, fieldname, usedisplay, raw_callable) for fieldname in fields]
+    if len(_accessors_cache) >= _ACCESSORS_CACHE_SIZE:
+        _accessors_cache.clear()
+    _accessors_cache[key] = accessors
+    return accessors
+
+
+def _get_ordering(queryset):
+    query = queryset.query
+    if query.extra_order_by:
+        return list(query.extra_order_by)
+    if query.order_by:
+        return list(query.order_by)
+    if query.default_ordering:
+        return list(queryset.model._meta.ordering)
+    return []
+
+
+def _get_keyset(queryset):
+    """
+    returns the ordering of ``queryset`` as a list of (fieldname, descending)
+    that ends with the primary key, or None if it cannot be used to paginate
+    with keyset conditions (NULL values, ordering by relations, expressions, random...)
+    """
+    if queryset.query.extra_order_by:
+        return None
+    opts = queryset.model._meta
+    keyset = []
+    for item in _get_ordering(queryset):
+        if not isinstance(item, six.string_types) or item == '?':
+            return None
+        descending = item.startswith('-')
+        name = item.lstrip('-')
+        if name in ('pk', opts.pk.name):
+            keyset.append(('pk', descending))
+            return keyset
+        try:
+            field = opts.get_field(name)
+        except FieldDoesNotExist:
+            return None
+        if field.null or getattr(field, 'rel', None) or not getattr(field, 'column', None):
+            return None
+        keyset.append((name, descending))
+    # ordering is not unique
+    keyset.append(('pk', False))
+    return keyset
+
+
+def _get_keyset_filter(keyset, values):
+    """
+    returns the condition that selects the records that follow ``values``
+    in the ``keyset`` ordering, ie. (a, -pk) -> a > x OR (a = x AND pk < y)
+    """
+    condition = None
+    for i, (name, descending) in enumerate(keyset):
+        term = models.Q(**{'%s__%s' % (name, 'lt' if descending else 'gt'): values[i]})
+        for (prev, __), value in zip(keyset[:i], values[:i]):
+            term &= models.Q(**{prev: value})
+        condition = term if condition is None else condition | term
+    return condition
+
+
+class _FetchManyCursor(object):
+    """
+    wraps a psycopg2 named cursor so that each ``fetchmany()`` reads ``size`` rows,
+    whatever number of rows Django asks for
+    """
+
+    def __init__(self, cursor, size):
+        self._cursor = cursor
+        self._size = size
+
+    def fetchmany(self, size=None):
+        return self._cursor.fetchmany(self._size)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+def iter_server_side(queryset, fetch_size):
+    """
+    iterates over ``queryset`` using a PostgreSQL server-side (named) cursor that
+    reads ``fetch_size`` rows at time, so the client never holds the whole result set.
+    On other backends, and with django >= 1.11 whose ``iterator()`` already
+    uses server-side cursors, it is the same as ``queryset.iterator()``.
+
+    :param queryset: :class:`django.db.models.query.QuerySet`
+    :param fetch_size: number of rows read for each round trip
+    :return: iterator
+    """
+    connection = connections[queryset.db]
+    rows = queryset.iterator()
+    if connection.vendor != 'postgresql' or django.VERSION >= (1, 11):
+        for obj in rows:
+            yield obj
+        return
+
+    from django.db.backends.postgresql_psycopg2.base import utc_tzinfo_factory
+
+    def create_cursor():
+        # named cursors are only allowed in transactions, unless declared WITH HOLD
+        cursor = connection.connection.cursor(name='adminactions_%s' % uuid.uuid4().hex,
+                                              withhold=not connection.in_atomic_block)
+        cursor.tzinfo_factory = utc_tzinfo_factory if settings.USE_TZ else None
+        return _FetchManyCursor(cursor, fetch_size)
+
+    # the query is executed, so the cursor created, when the first row is read
+    connection.create_cursor = create_cursor
+    try:
+        first = next(rows)
+    except StopIteration:
+        return
+    finally:
+        del connection.create_cursor
+    yield first
+    for obj in rows:
+        yield obj
+
+
+def iter_queryset(queryset, chunk_size=None, fetch_size=None):
+    """
+    iterates over ``queryset`` without filling its result cache, so that
+    memory usage does not grow with the number of records.
+
+    If ``chunk_size`` is None ``queryset.iterator()`` is used, otherwise records are
+    fetched ``chunk_size`` at time: using keyset pagination on the ordering of the queryset
+    (plus the primary key) when it contains only not nullable columns of the model,
+    as the admin changelist does, LIMIT/OFFSET slices otherwise.
+    If ``chunk_size`` is None and ``fetch_size`` is set, PostgreSQL server-side
+    cursors are used (see :func:`iter_server_side`).
+    Anything that is not a QuerySet is simply iterated.
+
+    :param queryset: :class:`django.db.models.query.QuerySet` or any iterable
+    :param chunk_size: number of records to fetch for each query
+    :param fetch_size: number of records to read for each round trip of a server-side cursor
+    :return: iterator
+
+    >>> from django.contrib.auth.models import Permission
+    >>> qs = Permission.objects.filter(codename='add_user')
+    >>> [p.codename for p in iter_queryset(qs, 10)]
+    [u'add_user']
+    """
+    if not isinstance(queryset, QuerySet):
+        for obj in queryset:
+            yield obj
+        return
+
+    if not chunk_size:
+        if queryset._result_cache is not None or queryset._prefetch_related_lookups:
+            # already evaluated or iterator() would ignore prefetch_related()
+            rows = queryset
+        elif fetch_size:
+            rows = iter_server_side(queryset, fetch_size)
+        else:
+            rows = queryset.iterator()
+        for obj in rows:
+            yield obj
+        return
+
+    keyset = None
+    sliced = queryset.query.low_mark or queryset.query.high_mark is not None
+    if not sliced:
+        keyset = _get_keyset(queryset)
+    if keyset is not None:
+        lookups = [name for name, __ in keyset]
+        queryset = queryset.order_by(*[('-' if descending else '') + name for name, descending in keyset])
+        chunk = queryset
+        while True:
+            try:
+                last = chunk.values_list(*lookups)[chunk_size - 1]
+            except IndexError:
+                for obj in chunk:
+                    yield obj
+                return
+            for obj in chunk[:chunk_size]:
+                yield obj
+            chunk = queryset.filter(_get_keyset_filter(keyset, last))
+    else:
+        ordering = _get_ordering(queryset)
+        pk_name = queryset.model._meta.pk.name
+        if not sliced and not any(f in ('pk', '-pk', pk_name, '-' + pk_name) for f in ordering):
+            # a unique ordering is needed to get consistent slices
+            queryset = queryset.order_by(*(ordering + ['pk']))
+        offset = 0
+        while True:
+            chunk = list(queryset[offset:offset + chunk_size])
+            for obj in chunk:
+                yield obj
+            if len(chunk) < chunk_size:
+                return
+            offset += chunk_size
+
+
 def get_field_by_path(model, field_path):
     """
     get a Model class or instance and a path to a attribute, returns the field object
@@ -251,3 +524,59 @@ def flatten(iterable):
 def model_supports_transactions(instance):
     alias = router.db_for_write(instance)
     return connections[alias].features.supports_transactions
+
+
+def normalize(value):
+    """
+    >>> from adminactions.utils import normalize
+    >>> print(normalize('  Mr.  Rossi-Bianchi '))
+    mr rossi bianchi
+    >>> print(normalize('Città'))
+    citta
+    """
+    value = unicodedata.normalize('NFKD', smart_text(value))
+    value = ''.join(c for c in value if not unicodedata.combining(c))
+    return ' '.join(re.sub(r'[\W_]+', ' ', value.lower(), flags=re.UNICODE).split())
+
+
+def prefix(value, length=4):
+    """
+    >>> from adminactions.utils import prefix
+    >>> print(prefix('Rossi Mario'))
+    ross
+    """
+    return normalize(value)[:length]
+
+
+SOUNDEX_CODES = dict((c, str(code)) for code, letters in enumerate(['aeiouyhw', 'bfpv', 'cgjkqsxz',
+                                                                      'dt', 'l', 'mn', 'r'])
+                     for c in letters)
+
+
+def soundex(value):
+    """
+    American soundex of the first word of `value`
+
+    >>> from adminactions.utils import soundex
+    >>> print(soundex('Robert'))
+    R163
+    >>> print(soundex('Rupert Smith'))
+    R163
+    >>> print(soundex('Ashcraft'))
+    A261
+    >>> print(soundex('Tymczak'))
+    T522
+    """
+    words = normalize(value).split()
+    word = ''.join(c for c in words[0] if c in SOUNDEX_CODES) if words else ''
+    if not word:
+        return ''
+    codes = [SOUNDEX_CODES[c] for c in word]
+    ret = [word[0].upper()]
+    last = codes[0]
+    for c, code in zip(word[1:], codes[1:]):
+        if code != '0' and code != last:
+            ret.append(code)
+        if c not in 'hw':
+            last = code
+    return (''.join(ret) + '000')[:4]
@@ -1,9 +1,47 @@
 from __future__ import absolute_import, unicode_literals
 import datetime
-from django.http import HttpResponse
+from wsgiref.util import FileWrapper
+from django.contrib.admin.views.decorators import staff_member_required
+from django.core.exceptions import PermissionDenied
+from django.http import Http404, HttpResponse
+from django.shortcuts import render_to_response
+from django.template.context import RequestContext
 from django.utils import dateformat
+from adminactions.api import StreamingHttpResponse
+from adminactions.jobs import ExportJob, get_storage
 
 
 def format_date(request):
     d = datetime.datetime.now()
     return HttpResponse(dateformat.format(d, request.GET.get('fmt', '')))
+
+
+def _get_job(request, job_id):
+    try:
+        job = ExportJob.load(job_id)
+    except (IOError, OSError, ValueError):
+        raise Http404
+    if not (request.user.is_superuser or request.user.pk == job.user):
+        raise PermissionDenied
+    return job
+
+
+@staff_member_required
+def export_status(request, job_id):
+    job = _get_job(request, job_id)
+    ctx = {'job': job,
+           'title': 'Export %s' % job.filename}
+    return render_to_response('adminactions/export_status.html', RequestContext(request, ctx))
+
+
+@staff_member_required
+def export_download(request, job_id):
+    job = _get_job(request, job_id)
+    if job.status != ExportJob.DONE:
+        raise Http404
+    storage = get_storage()
+    response = StreamingHttpResponse(FileWrapper(storage.open(job.result)),
+                                     content_type='application/octet-stream')
+    response['Content-Length'] = storage.size(job.result)
+    response['Content-Disposition'] = ('attachment;filename="%s"' % job.filename).encode('us-ascii', 'replace')
+    return response
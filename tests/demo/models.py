@@ -2,6 +2,8 @@
 from __future__ import absolute_import, unicode_literals
 from django.contrib.admin import ModelAdmin, site
 from django.contrib.auth.models import User
+from django.contrib.contenttypes.fields import GenericForeignKey, GenericRelation
+from django.contrib.contenttypes.models import ContentType
 from django.db import models
 
 
@@ -33,9 +35,34 @@ class DemoModel(models.Model):
         app_label = 'demo'
 
 
+class SubclassedDemoModel(DemoModel):
+    note = models.CharField(max_length=10, blank=True)
+
+    class Meta:
+        app_label = 'demo'
+
+
 class UserDetail(models.Model):
     user = models.ForeignKey(User)
     note = models.CharField(max_length=10, blank=True)
+    tags = GenericRelation('demo.Tag')
+
+    class Meta:
+        app_label = 'demo'
+
+
+class UserProfile(models.Model):
+    user = models.OneToOneField(User)
+
+    class Meta:
+        app_label = 'demo'
+
+
+class Tag(models.Model):
+    content_type = models.ForeignKey(ContentType)
+    object_id = models.PositiveIntegerField()
+    content_object = GenericForeignKey()
+    name = models.CharField(max_length=10)
 
     class Meta:
         app_label = 'demo'
@@ -3,8 +3,9 @@ from __future__ import absolute_import, unicode_literals
 import six
 import xlrd
 import unittest
+import mock
 from collections import namedtuple
-from django.http import HttpResponse
+from django.http import HttpResponse, StreamingHttpResponse
 from django.contrib.auth.models import Permission
 from django.test import TestCase
 
@@ -12,7 +13,7 @@ if six.PY3:
     import csv
 elif six.PY2:
     import unicodecsv as csv
-from adminactions.api import export_as_csv, export_as_xls
+from adminactions.api import export_as_csv, export_as_xls, export_as_xlsx
 
 
 class TestExportQuerySetAsCsv(TestCase):
@@ -72,6 +73,74 @@ class TestExportQuerySetAsCsv(TestCase):
         else:
             self.assertEquals(csv_dump, '"add_user";"auth"\r\n')
 
+    def test_values_list(self):
+        # concrete columns and paths to them do not need model instances
+        fields = ['codename', 'content_type.app_label']
+        mem = six.StringIO()
+        with mock.patch.object(Permission, '__init__', side_effect=AssertionError):
+            with self.assertNumQueries(1):
+                qs = Permission.objects.filter(codename='add_user')
+                export_as_csv(queryset=qs, fields=fields, out=mem)
+        mem.seek(0)
+        csv_dump = mem.read()
+        if six.PY2:
+            self.assertEquals(csv_dump.decode('utf8'), u'"add_user";"auth"\r\n')
+        else:
+            self.assertEquals(csv_dump, '"add_user";"auth"\r\n')
+
+    def test_copy_fallback(self):
+        # COPY is only available on PostgreSQL
+        fields = ['codename', 'content_type.app_label']
+        qs = Permission.objects.filter(codename='add_user')
+        response = export_as_csv(queryset=qs, fields=fields, options={'engine': 'copy'})
+        self.assertEqual(response.content, b'"add_user";"auth"\r\n')
+
+    def test_copy(self):
+        def copy_to(using, sql, out):
+            out.write(b'"add_user";"auth"\n')
+            return 1
+
+        qs = Permission.objects.filter(codename='add_user')
+        with mock.patch('adminactions.api.connections') as connections:
+            connection = connections.__getitem__.return_value
+            connection.vendor = 'postgresql'
+            mogrify = connection.cursor.return_value.__enter__.return_value.cursor.mogrify
+            mogrify.return_value = b'SELECT codename, app_label'
+            with mock.patch('adminactions.api._copy_to', side_effect=copy_to) as _copy_to:
+                progress = mock.Mock()
+                response = export_as_csv(queryset=qs, fields=['codename', 'content_type.app_label'],
+                                         header=['Name', 'Application'],
+                                         options={'engine': 'copy', 'escapechar': '', 'progress': progress})
+                self.assertEqual(response.content, b'"Name";"Application"\n"add_user";"auth"\n')
+                progress.assert_called_once_with(1)
+                self.assertEqual(_copy_to.call_args[0][1], "COPY (SELECT codename, app_label) TO STDOUT "
+                                                           "WITH (FORMAT csv, DELIMITER ';', QUOTE '\"', FORCE_QUOTE *)")
+
+                # columns formatted by python
+                _copy_to.reset_mock()
+                export_as_csv(queryset=qs, fields=['codename', 'content_type'],
+                              options={'engine': 'copy', 'escapechar': ''})
+                export_as_csv(queryset=qs, fields=['codename'],
+                              options={'engine': 'copy', 'escapechar': '', 'quoting': csv.QUOTE_NONE})
+                # python escapes the escapechar
+                export_as_csv(queryset=qs, fields=['codename'], options={'engine': 'copy'})
+                self.assertFalse(_copy_to.called)
+
+    def test_select_related(self):
+        fields = ['codename', 'content_type', 'content_type.natural_key']
+        qs = Permission.objects.filter(content_type__app_label='auth')
+        with self.assertNumQueries(1):
+            response = export_as_csv(queryset=qs, fields=fields)
+        self.assertEqual(len(response.content.splitlines()), qs.count())
+
+    def test_values_list_display(self):
+        # get_FOO_display() defined without choices needs the instance
+        qs = Permission.objects.filter(codename='add_user')
+        with mock.patch.object(Permission, 'get_codename_display', create=True,
+                               new=lambda self: self.codename.upper()):
+            response = export_as_csv(queryset=qs, fields=['codename', 'content_type.app_label'])
+        self.assertEqual(response.content, b'"ADD_USER";"auth"\r\n')
+
 
 class TestExportAsCsv(unittest.TestCase):
     def test_export_as_csv(self):
@@ -149,6 +218,16 @@ class TestExportAsExcel(TestCase):
         self.assertEqual(xls_sheet.row_values(2)[:], [2.0, 333.0, 444.0])
         self.assertEqual(xls_sheet.row_values(3)[:], [3.0, 555.0, u'ӼӳӬԖԊ'])
 
+    def test_styles_are_cached(self):
+        import xlwt
+        qs = Permission.objects.all()
+        fields = ['id', 'name', 'codename', 'content_type']
+        mem = six.BytesIO()
+        with mock.patch('adminactions.api.xlwt.easyxf', wraps=xlwt.easyxf) as easyxf:
+            export_as_xls(queryset=qs, fields=fields, out=mem)
+        # one for the header and one for each distinct format, regardless of the number of rows
+        self.assertLessEqual(easyxf.call_count, 1 + len(fields))
+
 
 class TestExportQuerySetAsExcel(TestCase):
     def test_queryset_values(self):
@@ -174,3 +253,41 @@ class TestExportQuerySetAsExcel(TestCase):
         sheet = w.sheet_by_index(0)
         self.assertEquals(sheet.cell_value(1, 1), u'add_user')
         self.assertEquals(sheet.cell_value(1, 2), u'add_userauthuser')
+
+    def test_values_list(self):
+        fields = ['codename', 'content_type.app_label']
+        qs = Permission.objects.filter(codename='add_user')
+        mem = six.BytesIO()
+        with mock.patch.object(Permission, '__init__', side_effect=AssertionError):
+            export_as_xls(queryset=qs, fields=fields, out=mem)
+        mem.seek(0)
+        w = xlrd.open_workbook(file_contents=mem.read())
+        sheet = w.sheet_by_index(0)
+        self.assertEquals(sheet.cell_value(1, 1), u'add_user')
+        self.assertEquals(sheet.cell_value(1, 2), u'auth')
+
+
+class TestExportAsXlsx(TestCase):
+    def test_default_params(self):
+        qs = Permission.objects.select_related().filter(codename='add_user')
+        ret = export_as_xlsx(queryset=qs)
+        self.assertIsInstance(ret, StreamingHttpResponse)
+        content = b''.join(ret.streaming_content)
+        self.assertEqual(int(ret['Content-Length']), len(content))
+        sheet = xlrd.open_workbook(file_contents=content).sheet_by_index(0)
+        self.assertEqual(sheet.row_values(1)[2:], ['Can add user', 'user', 'add_user'])
+
+    def test_export_as_xlsx(self):
+        fields = ['field1', 'field2']
+        header = ['Field 1', 'Field 2']
+        Row = namedtuple('Row', fields)
+        rows = [Row(111, 222),
+                Row(333, 444),
+                Row(555, u'ӼӳӬԖԊ')]
+        mem = six.BytesIO()
+        export_as_xlsx(queryset=rows, fields=fields, header=header, out=mem)
+        mem.seek(0)
+        sheet = xlrd.open_workbook(file_contents=mem.read()).sheet_by_index(0)
+        self.assertEqual(sheet.row_values(0)[:], [u'#', u'Field 1', u'Field 2'])
+        self.assertEqual(sheet.row_values(1)[:], [1.0, 111.0, 222.0])
+        self.assertEqual(sheet.row_values(3)[:], [3.0, 555.0, u'ӼӳӬԖԊ'])
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, unicode_literals
+from django.contrib.auth.models import User
+from django_dynamic_fixture import G
+from django_webtest import WebTest
+import mock
+import six
+from adminactions.api import bulk_delete
+from demo.models import UserDetail
+from adminactions.signals import adminaction_end
+from demo.utils import CheckSignalsMixin, user_grant_permission, SelectRowsMixin
+
+
+class TestBulkDelete(SelectRowsMixin, CheckSignalsMixin, WebTest):
+    fixtures = ['adminactions', 'demoproject']
+    urls = 'demo.urls'
+    sender_model = User
+    action_name = 'bulk_delete'
+    _selected_rows = [2, 3, 4]
+
+    def setUp(self):
+        super(TestBulkDelete, self).setUp()
+        self.user = G(User, username='user', is_staff=True, is_active=True)
+
+    def _run_action(self, steps=2, perms=('auth.change_user', 'auth.delete_user', 'demo.delete_userdetail')):
+        with user_grant_permission(self.user, list(perms)):
+            res = self.app.get('/', user='user')
+            res = res.click('Users')
+            if steps >= 1:
+                form = res.forms['changelist-form']
+                form['action'] = 'bulk_delete'
+                self._select_rows(form)
+                res = form.submit()
+            if steps >= 2:
+                res.form['chunk_size'] = 2
+                res = res.form.submit('apply')
+            return res
+
+    def test_no_permission(self):
+        with user_grant_permission(self.user, ['auth.change_user']):
+            res = self.app.get('/', user='user')
+            res = res.click('Users')
+            form = res.forms['changelist-form']
+            form['action'] = 'bulk_delete'
+            self._select_rows(form)
+            res = form.submit().follow()
+            assert six.b('Sorry you do not have rights to execute this action') in res.body
+
+    def test_cascade_permission(self):
+        # user cannot delete the related UserDetail
+        self._run_action(1)
+        for pk in self._selected_values:
+            G(UserDetail, user=User.objects.get(pk=pk))
+        with user_grant_permission(self.user, ['auth.change_user', 'auth.delete_user']):
+            res = self.app.get('/', user='user')
+            res = res.click('Users')
+            form = res.forms['changelist-form']
+            form['action'] = 'bulk_delete'
+            self._select_rows(form)
+            res = form.submit().follow()
+            self.assertIn('Sorry you do not have rights to delete: user detail', res.text)
+        self.assertEqual(User.objects.filter(pk__in=self._selected_values).count(), len(self._selected_values))
+
+    def test_signal_sent(self):
+        # records are already deleted when adminaction_end is sent
+        self.test_signal_end()
+
+    def test_signal_end(self):
+        def myhandler(sender, action, request, queryset, updated, **kwargs):
+            myhandler.invoked = True
+            self.assertEqual(action, self.action_name)
+            self.assertEqual(updated, len(self._selected_values))
+            self.assertFalse(queryset.exists())
+
+        try:
+            adminaction_end.connect(myhandler, sender=self.sender_model)
+            self._run_action(2)
+            self.assertTrue(myhandler.invoked)
+        finally:
+            adminaction_end.disconnect(myhandler, sender=self.sender_model)
+
+    def test_success(self):
+        res = self._run_action(1)
+        for pk in self._selected_values:
+            G(UserDetail, user=User.objects.get(pk=pk))
+        self.assertNotIn(self.user.pk, self._selected_values)  # sanity check
+        res = self._run_action(2)
+        self.assertFalse(User.objects.filter(pk__in=self._selected_values).exists())
+        self.assertFalse(UserDetail.objects.filter(user__pk__in=self._selected_values).exists())
+        self.assertTrue(User.objects.filter(pk=self.user.pk).exists())
+
+    def test_api(self):
+        users = [G(User) for __ in range(5)]
+        for user in users:
+            G(UserDetail, user=user)
+        progress = mock.Mock()
+        deleted = bulk_delete(User.objects.filter(pk__in=[u.pk for u in users]), 2, progress)
+        self.assertEqual(deleted, 5)
+        self.assertEqual([c[0][0] for c in progress.call_args_list], [2, 4, 5])
+        self.assertFalse(UserDetail.objects.filter(user__in=users).exists())
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, unicode_literals
+from django.contrib.auth.models import User
+from django_dynamic_fixture import G
+from django_webtest import WebTest
+import six
+from adminactions.api import find_duplicates
+from demo.utils import CheckSignalsMixin, user_grant_permission, SelectRowsMixin
+
+
+class TestFindDuplicatesApi(WebTest):
+    def setUp(self):
+        User.objects.all().delete()
+        self.users = [G(User, first_name=name, last_name='Rossi') for name in
+                      ['Mario', 'mario ', 'Mariò', 'Marion', 'Robert', 'Rupert', '']]
+
+    def _names(self, clusters):
+        return [sorted(User.objects.filter(pk__in=c).values_list('first_name', flat=True)) for c in clusters]
+
+    def test_exact(self):
+        self.assertEqual(find_duplicates(User.objects.all(), ['first_name'], 'exact'), [])
+        clusters = find_duplicates(User.objects.all(), ['last_name'], 'exact', min_size=6)
+        self.assertEqual(len(clusters), 1)
+        self.assertEqual(len(clusters[0]), 7)
+
+    def test_normalized(self):
+        clusters = find_duplicates(User.objects.all(), ['first_name'], 'normalized')
+        self.assertEqual(self._names(clusters), [['Mario', 'Mariò', 'mario ']])
+
+    def test_prefix(self):
+        clusters = find_duplicates(User.objects.all(), ['first_name', 'last_name'], 'prefix')
+        self.assertEqual(self._names(clusters), [['Mario', 'Marion', 'Mariò', 'mario ']])
+
+    def test_falsy_values(self):
+        User.objects.update(is_staff=False)
+        G(User, is_staff=True)
+        clusters = find_duplicates(User.objects.all(), ['is_staff'], 'exact')
+        self.assertEqual([len(c) for c in clusters], [7])
+        clusters = find_duplicates(User.objects.all(), ['first_name', 'is_staff'], 'normalized')
+        self.assertEqual([len(c) for c in clusters], [3])
+
+    def test_soundex(self):
+        clusters = find_duplicates(User.objects.all(), ['first_name'], 'soundex', chunk_size=2)
+        self.assertEqual(self._names(clusters), [['Mario', 'Mariò', 'mario '], ['Robert', 'Rupert']])
+
+
+class TestFindDuplicatesAction(SelectRowsMixin, CheckSignalsMixin, WebTest):
+    fixtures = ['adminactions', 'demoproject']
+    urls = 'demo.urls'
+    sender_model = User
+    action_name = 'find_duplicates'
+    _selected_rows = [0, 1, 2]
+
+    def setUp(self):
+        super(TestFindDuplicatesAction, self).setUp()
+        self.user = G(User, username='user', is_staff=True, is_active=True)
+        User.objects.update(last_name='Smith')
+
+    def _run_action(self, steps=2):
+        with user_grant_permission(self.user, ['auth.change_user', 'auth.adminactions_merge_user']):
+            res = self.app.get('/', user='user')
+            res = res.click('Users')
+            if steps >= 1:
+                form = res.forms['changelist-form']
+                form['action'] = 'find_duplicates'
+                self._select_rows(form)
+                res = form.submit()
+            if steps >= 2:
+                res.form['fields'] = ['last_name']
+                res.form['key'] = 'exact'
+                res = res.form.submit('apply')
+            return res
+
+    def test_no_permission(self):
+        with user_grant_permission(self.user, ['auth.change_user']):
+            res = self.app.get('/', user='user')
+            res = res.click('Users')
+            form = res.forms['changelist-form']
+            form['action'] = 'find_duplicates'
+            self._select_rows(form)
+            res = form.submit().follow()
+            assert six.b('Sorry you do not have rights to execute this action') in res.body
+
+    def test_merge_cluster(self):
+        res = self._run_action()
+        cluster = res.forms[1]
+        self.assertEqual(sorted(int(f.value) for f in cluster.fields['_selected_action']),
+                         sorted(self._selected_values))
+        with user_grant_permission(self.user, ['auth.change_user', 'auth.adminactions_merge_user']):
+            res = cluster.submit()
+            self.assertEqual(int(res.form['master_pk'].value), self._selected_values[0])
+
+    def test_max_records(self):
+        with self.settings(ADMINACTIONS_DUPLICATES_MAX_RECORDS=2):
+            res = self._run_action()
+        cluster = res.forms[1]
+        self.assertEqual(len(cluster.fields['_selected_action']), 2)
+        self.assertIn(six.b('3 records (showing 2)'), res.body)
@@ -13,8 +13,10 @@ else:
 from django.utils.encoding import smart_text
 from django_webtest import WebTest
 from django_dynamic_fixture import G
-from django.contrib.auth.models import User
-from django.test.utils import override_settings
+from django.contrib.auth.models import Group, Permission, User
+from django.contrib.contenttypes.models import ContentType
+from django.db import connection
+from django.test.utils import CaptureQueriesContext, override_settings
 
 from demo.utils import (user_grant_permission, admin_register,
                         CheckSignalsMixin, SelectRowsMixin)
@@ -74,6 +76,62 @@ class ExportAsFixtureTest(ExportMixin, SelectRowsMixin, CheckSignalsMixin, WebTe
             res = res.form.submit('apply')
             assert res.json[0]['pk'] == 1
 
+    def test_foreign_keys_collector(self):
+        from adminactions.export import ForeignKeysCollector
+
+        perms = list(Permission.objects.filter(content_type__app_label='auth', content_type__model='user'))
+        group = G(Group, permissions=perms[:2])
+        users = [G(User, groups=[group]) for __ in range(10)]
+        users[0].user_permissions.add(perms[2])
+
+        c = ForeignKeysCollector(None)
+        # users, groups, user_permissions | group, group.permissions, permission | permissions | contenttype
+        with self.assertNumQueries(8):
+            c.collect(User.objects.filter(pk__in=[u.pk for u in users]))
+        self.assertEqual(len(c.data), len(set((o.__class__, o.pk) for o in c.data)))
+        self.assertEqual(set((o.__class__, o.pk) for o in c.data),
+                         set([(User, u.pk) for u in users] + [(Group, group.pk)] +
+                             [(Permission, p.pk) for p in perms[:3]] +
+                             [(ContentType, perms[0].content_type_id)]))
+
+    def test_serialize_iter(self):
+        from django.core import serializers
+        from adminactions.export import _serialize_iter
+
+        users = list(User.objects.all())
+        for fmt in ('json', 'xml'):
+            for indent in (None, 4):
+                chunks = list(_serialize_iter(serializers.get_serializer(fmt)(), users, 2, indent=indent))
+                self.assertEqual(len(chunks), len(users) // 2 + 1)
+                self.assertEqual(''.join(chunks), serializers.serialize(fmt, users, indent=indent))
+
+    def test_dump_qs(self):
+        from adminactions.export import FixtureOptions, _dump_qs
+
+        form = FixtureOptions({'serializer': 'json', 'indent': 4, 'action': self.action_name,
+                               '_selected_action': '1'})
+        self.assertTrue(form.is_valid())
+        # errors in the first chunk are raised before the response is returned
+        self.assertRaises(AttributeError, _dump_qs, form, User.objects.all(), [object()], None)
+
+        done = []
+        response = _dump_qs(form, User.objects.all(), list(User.objects.all()), None, lambda: done.append(1))
+        self.assertEqual(done, [])
+        b''.join(response.streaming_content)
+        self.assertEqual(done, [1])
+
+    def test_streaming(self):
+        with user_grant_permission(self.user, ['auth.change_user', 'auth.adminactions_export_user']):
+            res = self.app.get('/', user='user')
+            res = res.click('Users')
+            form = res.forms['changelist-form']
+            form['action'] = self.action_name
+            self._select_rows(form)
+            res = form.submit()
+            res.form['serializer'] = 'xml'
+            res = res.form.submit('apply')
+            self.assertEqual(res.body.count(b'model="auth.user"'), len(self._selected_rows))
+
     def _run_action(self, steps=2):
         with user_grant_permission(self.user, ['auth.change_user', 'auth.adminactions_export_user']):
             res = self.app.get('/', user='user')
@@ -115,6 +173,44 @@ class ExportDeleteTreeTest(ExportMixin, SelectRowsMixin, CheckSignalsMixin, WebT
             res = res.form.submit('apply')
             assert res.json[0]['pk'] == 1
 
+    def test_summary(self):
+        from django.db.models.deletion import Collector
+        from adminactions.api import get_delete_summary
+        from demo.models import Tag, UserDetail
+
+        group = G(Group)
+        users = [G(User, groups=[group]) for __ in range(3)]
+        for user in users:
+            detail = G(UserDetail, user=user)
+            G(Tag, content_type=ContentType.objects.get_for_model(UserDetail), object_id=detail.pk)
+            G(UserDetail, user=user)
+        queryset = User.objects.filter(pk__in=[u.pk for u in users])
+
+        collector = Collector('default')
+        collector.collect(queryset)
+        expected = dict((model, len(instances)) for model, instances in collector.data.items())
+        expected.update((qs.model, qs.count()) for qs in collector.fast_deletes if qs.exists())
+
+        summary = get_delete_summary(queryset)
+        self.assertFalse(summary.truncated)
+        summary = dict((model, count) for model, count in summary if count)
+        self.assertEqual(summary, expected)
+        self.assertEqual(summary[Tag], 3)
+
+        # Tag is two relations away
+        summary = get_delete_summary(queryset, max_depth=1)
+        self.assertTrue(summary.truncated)
+        self.assertNotIn(Tag, dict(summary))
+
+        with user_grant_permission(self.user, ['auth.change_user', 'auth.adminactions_export_user']):
+            res = self.app.get('/', user='user')
+            res = res.click('Users')
+            form = res.forms['changelist-form']
+            form['action'] = self.action_name
+            self._select_rows(form, [0])
+            res = form.submit()
+            self.assertIn('auth | Users</th><td>1</td>', res.text)
+
     def _run_action(self, steps=2):
         with user_grant_permission(self.user, ['auth.change_user', 'auth.adminactions_export_user']):
             res = self.app.get('/', user='user')
@@ -212,6 +308,28 @@ class ExportAsCsvTest(ExportMixin, SelectRowsMixin, CheckSignalsMixin, WebTest):
                 res = res.form.submit('apply')
         return res
 
+    @override_settings(ADMINACTIONS_EXPORT_CHUNK_SIZE=2)
+    def test_chunked_changelist(self):
+        # the changelist queryset is ordered by '-pk' too: pages must not use OFFSET
+        for i in range(5):
+            G(User)
+        with user_grant_permission(self.user, ['auth.change_user', 'auth.adminactions_export_user']):
+            res = self.app.get('/', user='user')
+            res = res.click('Users')
+            form = res.forms['changelist-form']
+            form['action'] = self.action_name
+            form.set('_selected_action', True, 0)
+            form['select_across'] = 1
+            res = form.submit()
+            res.form['columns'] = ['username']
+            with CaptureQueriesContext(connection) as ctx:
+                res = res.form.submit('apply')
+        rows = [r for r in smart_text(res.body).splitlines()]
+        self.assertEqual(len(rows), User.objects.count())
+        offsets = [q['sql'] for q in ctx.captured_queries if 'OFFSET' in q['sql']]
+        self.assertTrue(offsets)
+        self.assertFalse([sql for sql in offsets if 'LIMIT 1 OFFSET 1' not in sql])
+
     @override_settings(ADMINACTIONS_STREAM_CSV=True)
     def test_streaming_export(self):
         res = self._run_action()
@@ -1,10 +1,16 @@
 from __future__ import absolute_import
+import datetime
+import mock
 from django.contrib.auth.models import User
 from django.core.urlresolvers import reverse
+from django.db.models.signals import post_delete, post_save
 from django_dynamic_fixture import G
 from django_webtest import WebTest
+from demo.models import DemoModel, SubclassedDemoModel, UserDetail
 from demo.utils import CheckSignalsMixin, user_grant_permission, SelectRowsMixin
 from six.moves import range
+from adminactions.graph import (connect_graph_cache, get_cached_graph_data, get_graph_cache, get_graph_data,
+                                get_related_labels, invalidate_graph_cache)
 
 
 class TestGraph(SelectRowsMixin, CheckSignalsMixin, WebTest):
@@ -58,3 +64,109 @@ class TestGraph(SelectRowsMixin, CheckSignalsMixin, WebTest):
         res.form['graph_type'] = 'PieChart'
         res.form['axes_x'] = 'is_staff'
         res = res.form.submit()
+
+    def test_related_labels(self):
+        users = [G(User) for i in range(5)]
+        field = UserDetail._meta.get_field('user')
+        with self.assertNumQueries(1):
+            labels = get_related_labels(field, [u.pk for u in users] + [None])
+        self.assertEqual(labels, dict((u.pk, str(u)) for u in users))
+
+    def test_top(self):
+        User.objects.all().delete()
+        for name in ['a', 'a', 'a', 'b', 'b', 'c', 'd']:
+            G(User, first_name=name)
+        labels, data = get_graph_data(User.objects.all(), 'first_name', top=2)
+        self.assertEqual(labels, ['a', 'b', 'Other'])
+        self.assertEqual(data, [3, 2, 2])
+
+        labels, data = get_graph_data(User.objects.all(), 'first_name', top=10)
+        self.assertEqual(sorted(labels), ['a', 'b', 'c', 'd'])
+
+    def test_time_series(self):
+        DemoModel.objects.all().delete()
+        for day in [datetime.date(2013, 12, 30), datetime.date(2014, 1, 2), datetime.date(2014, 1, 6),
+                    datetime.date(2014, 2, 1), datetime.date(2015, 1, 1)]:
+            G(DemoModel, date=day, datetime=datetime.datetime.combine(day, datetime.time(13, 0)))
+        qs = DemoModel.objects.all()
+        for field in ['date', 'datetime']:
+            self.assertEqual(get_graph_data(qs, field, bucket='year'), (['2013', '2014', '2015'], [1, 3, 1]))
+            self.assertEqual(get_graph_data(qs, field, bucket='month'),
+                             (['2013-12', '2014-01', '2014-02', '2015-01'], [1, 2, 1, 1]))
+            self.assertEqual(get_graph_data(qs, field, bucket='week'),
+                             (['2013-12-30', '2014-01-06', '2014-01-27', '2014-12-29'], [2, 1, 1, 1]))
+            self.assertEqual(get_graph_data(qs, field, bucket='day')[1], [1, 1, 1, 1, 1])
+        with self.assertRaises(ValueError):
+            get_graph_data(qs, 'char', bucket='day')
+
+    def test_time_series_inherited(self):
+        # the date fields are in the table of the parent model
+        DemoModel.objects.all().delete()
+        for day in [datetime.date(2014, 1, 2), datetime.date(2014, 1, 6), datetime.date(2015, 1, 1)]:
+            G(SubclassedDemoModel, date=day, datetime=datetime.datetime.combine(day, datetime.time(13, 0)))
+        G(DemoModel, date=datetime.date(2013, 1, 1))
+        qs = SubclassedDemoModel.objects.all()
+        for field in ['date', 'datetime']:
+            self.assertEqual(get_graph_data(qs, field, bucket='year'), (['2014', '2015'], [2, 1]))
+
+    def test_cache(self):
+        caches = {'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'},
+                  'graph': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                            'LOCATION': 'graph'}}
+        with self.settings(CACHES=caches, ADMINACTIONS_GRAPH_CACHE='graph'):
+            connect_graph_cache()
+            self.addCleanup(post_save.disconnect, dispatch_uid='adminactions_graph_cache_save')
+            self.addCleanup(post_delete.disconnect, dispatch_uid='adminactions_graph_cache_delete')
+            get_graph_cache().clear()
+            qs = User.objects.filter(is_active=True)
+            data = get_cached_graph_data(qs, 'is_staff')
+            with self.assertNumQueries(0):
+                self.assertEqual(get_cached_graph_data(qs, 'is_staff'), data)
+            self.assertNotEqual(get_cached_graph_data(qs, 'is_superuser'), data)
+
+            G(User, is_active=True, is_staff=True)
+            self.assertNotEqual(get_cached_graph_data(qs, 'is_staff'), data)
+
+    def test_cache_signals(self):
+        # all the models are invalidated, only if the cache is enabled
+        with mock.patch('adminactions.graph.post_save') as post_save:
+            connect_graph_cache()
+            self.assertFalse(post_save.connect.called)
+            with self.settings(ADMINACTIONS_GRAPH_CACHE='graph'):
+                connect_graph_cache()
+            post_save.connect.assert_called_once_with(invalidate_graph_cache,
+                                                      dispatch_uid='adminactions_graph_cache_save')
+
+    def test_cache_invalidation(self):
+        caches = {'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'},
+                  'graph': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                            'LOCATION': 'graph'}}
+        with self.settings(CACHES=caches, ADMINACTIONS_GRAPH_CACHE='graph'):
+            get_graph_cache().clear()
+            qs = UserDetail.objects.all()
+            get_cached_graph_data(qs, 'note')
+            version = get_graph_cache().get('adminactions:graph:demo.UserDetail')
+            # saved by a process that never graphed the model
+            invalidate_graph_cache(UserDetail, instance=G(UserDetail))
+            self.assertEqual(get_graph_cache().get('adminactions:graph:demo.UserDetail'), version + 1)
+
+    def test_measures(self):
+        DemoModel.objects.all().delete()
+        for choice, integer, day in [(1, 10, 1), (1, 20, 2), (1, 20, 9), (2, 5, 1)]:
+            G(DemoModel, choices=choice, integer=integer, date=datetime.date(2014, 1, day))
+        qs = DemoModel.objects.all()
+        self.assertEqual(get_graph_data(qs, 'choices', measure='integer', function='sum'),
+                         (['Choice 1', 'Choice 2'], [50, 5]))
+        self.assertEqual(get_graph_data(qs, 'choices', measure='integer', function='max')[1], [20, 5])
+        self.assertEqual(get_graph_data(qs, 'choices', measure='integer', function='min')[1], [10, 5])
+        self.assertEqual(get_graph_data(qs, 'choices', measure='integer', function='distinct')[1], [2, 1])
+        self.assertEqual(get_graph_data(qs, 'choices', measure='integer', function='avg')[1][1], 5)
+        self.assertEqual(get_graph_data(qs, 'integer', top=1, measure='integer', function='sum'),
+                         (['20', 'Other'], [40, 15]))
+        self.assertEqual(get_graph_data(qs, 'date', bucket='week', measure='integer', function='max'),
+                         (['2013-12-30', '2014-01-06'], [20, 20]))
+        self.assertEqual(get_graph_data(qs, 'date', bucket='week', measure='integer', function='sum')[1], [35, 20])
+        with self.assertRaises(ValueError):
+            get_graph_data(qs, 'date', bucket='week', measure='integer', function='avg')
+        with self.assertRaises(ValueError):
+            get_graph_data(qs, 'choices', function='sum')
@@ -0,0 +1,120 @@
+# -*- encoding: utf-8 -*-
+from __future__ import absolute_import, unicode_literals
+import json
+import mock
+import os
+import shutil
+import tempfile
+import xlrd
+import six
+from django.contrib.auth.models import User
+from django.core import signing
+from django.utils import timezone
+from django.test.utils import override_settings
+from django_dynamic_fixture import G
+from django_webtest import WebTest
+
+from demo.models import DemoModel
+from demo.utils import user_grant_permission
+from adminactions.api import export_as_csv
+from adminactions.jobs import ExportJob, enqueue_export
+from adminactions.signals import adminaction_end
+
+
+class ExportJobTest(WebTest):
+    fixtures = ['adminactions', 'demoproject']
+    urls = 'demo.urls'
+
+    def setUp(self):
+        super(ExportJobTest, self).setUp()
+        self.user = G(User, username='user', is_staff=True, is_active=True)
+        self.export_root = tempfile.mkdtemp()
+        self.sett = override_settings(ADMINACTIONS_EXPORT_ROOT=self.export_root,
+                                      ADMINACTIONS_EXPORT_ASYNC=True,
+                                      ADMINACTIONS_EXPORT_EXECUTOR='adminactions.jobs.SyncExecutor')
+        self.sett.enable()
+
+    def tearDown(self):
+        self.sett.disable()
+        shutil.rmtree(self.export_root)
+        super(ExportJobTest, self).tearDown()
+
+    def _export(self, action):
+        with user_grant_permission(self.user, ['demo.change_demomodel',
+                                               'demo.adminactions_export_demomodel']):
+            res = self.app.get('/', user='user')
+            res = res.click('Demo models')
+            form = res.forms['changelist-form']
+            form['action'] = action
+            form.set('_selected_action', True, 0)
+            form.set('_selected_action', True, 1)
+            res = form.submit()
+            res = res.form.submit('apply').follow()
+            assert six.b('<td id="status">done</td>') in res.body
+            return res.click('Download')
+
+    def test_csv(self):
+        res = self._export('export_as_csv')
+        assert res.content_disposition == 'attachment;filename="demo_models.csv"'
+        assert len(res.body.splitlines()) == 2
+
+    def test_xls(self):
+        res = self._export('export_as_xls')
+        sheet = xlrd.open_workbook(file_contents=res.body).sheet_by_index(0)
+        assert sheet.nrows == 3
+
+    def test_other_user(self):
+        job = enqueue_export(export_as_csv, DemoModel.objects.all(), 'demo.csv')
+        self.app.get('/as/export/%s/' % job.id, user='user', status=403)
+
+    def test_progress(self):
+        qs = DemoModel.objects.all()
+        job = enqueue_export(export_as_csv, qs, 'demo.csv', options={'chunk_size': 1})
+        job = ExportJob.load(job.id)
+        assert job.status == ExportJob.DONE
+        assert job.processed == job.total == qs.count()
+
+    def test_state(self):
+        qs = DemoModel.objects.filter(datetime__lte=timezone.now(), char__isnull=False).order_by('-pk')
+        job = enqueue_export(export_as_csv, qs, 'demo.csv')
+        with open(os.path.join(self.export_root, job.status_file)) as f:
+            state = json.load(f)
+        assert 'pks' not in state
+        assert state['ordering'] == ['-pk']
+        assert [f for f in os.listdir(os.path.dirname(os.path.join(self.export_root, job.status_file)))
+                if f.endswith('.tmp')] == []
+        job = ExportJob.load(job.id)
+        assert list(job.get_queryset()) == list(qs)
+        assert list(job.get_queryset()) != list(DemoModel.objects.order_by('pk'))
+
+        job.query = signing.dumps({'sql': 'SELECT 1', 'params': []})
+        self.assertRaises(signing.BadSignature, job.get_queryset)
+
+    def test_empty(self):
+        job = enqueue_export(export_as_csv, DemoModel.objects.filter(pk__in=[]), 'demo.csv')
+        job = ExportJob.load(job.id)
+        assert job.status == ExportJob.DONE
+        assert job.total == 0
+
+    def test_progress_writes(self):
+        with mock.patch('adminactions.jobs.time.time', return_value=0):
+            with mock.patch.object(ExportJob, 'save', autospec=True, side_effect=ExportJob.save) as save:
+                enqueue_export(export_as_csv, DemoModel.objects.all(), 'demo.csv', options={'chunk_size': 1})
+        # enqueued, running, total, done: the progress of each chunk is not written
+        assert save.call_count == 4
+
+    def test_end_signal(self):
+        sent = []
+
+        def receiver(sender, **kwargs):
+            sent.append(kwargs)
+
+        adminaction_end.connect(receiver)
+        try:
+            job = enqueue_export(export_as_csv, DemoModel.objects.all(), 'demo.csv', action='export_as_csv')
+        finally:
+            adminaction_end.disconnect(receiver)
+        assert len(sent) == 1
+        assert sent[0]['action'] == 'export_as_csv'
+        assert sent[0]['job'].id == job.id
+        assert sent[0]['updated'] == DemoModel.objects.count()
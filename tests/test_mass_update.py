@@ -1,11 +1,13 @@
 from __future__ import absolute_import
 import six
+import mock
 from django.contrib.auth.models import User
 from django.core.urlresolvers import reverse
 from django_dynamic_fixture import G
 from django_webtest import WebTestMixin
 from django.test import TransactionTestCase
-from demo.models import DemoModel
+from demo.models import DemoModel, UserDetail
+from adminactions.mass_update import OPERATIONS, get_sample_values
 from demo.utils import CheckSignalsMixin, user_grant_permission, SelectRowsMixin
 
 
@@ -28,6 +30,7 @@ class MassUpdateTest(SelectRowsMixin, CheckSignalsMixin, WebTestMixin, Transacti
 
     def _run_action(self, steps=2, **kwargs):
         selected_rows = kwargs.pop('selected_rows', self._selected_rows)
+        func_char = kwargs.pop('func_id_char', 'upper')
         with user_grant_permission(self.user, ['demo.change_demomodel', 'demo.adminactions_massupdate_demomodel']):
             res = self.app.get('/', user='user')
             res = res.click('Demo models')
@@ -40,7 +43,7 @@ class MassUpdateTest(SelectRowsMixin, CheckSignalsMixin, WebTestMixin, Transacti
                 for k, v in kwargs.items():
                     res.form[k] = v
                 res.form['chk_id_char'].checked = True
-                res.form['func_id_char'] = 'upper'
+                res.form['func_id_char'] = func_char
                 res.form['chk_id_choices'].checked = True
                 res.form['func_id_choices'] = 'set'
                 res.form['choices'] = '1'
@@ -63,9 +66,41 @@ class MassUpdateTest(SelectRowsMixin, CheckSignalsMixin, WebTestMixin, Transacti
         assert not DemoModel.objects.filter(char='bbb').exists()
 
     def test_validate_off(self):
-        self._run_action(**{'_validate': 0})
+        self._run_action(**{'_validate': 0, 'func_id_char': 'capitalize'})
         self.assertIn("Unable no mass update using operators without", self.app.cookies['messages'])
 
+    def test_validate_off_expression(self):
+        with mock.patch.object(DemoModel, 'save', side_effect=AssertionError):
+            self._run_action(**{'_validate': 0})
+        assert DemoModel.objects.filter(char='BBB').exists()
+        assert not DemoModel.objects.filter(char='bbb').exists()
+
+    def test_expressions(self):
+        record = DemoModel.objects.get(pk=1)
+        fields = dict((f.name, f) for f in DemoModel._meta.fields)
+        qs = DemoModel.objects.filter(pk=1)
+        qs.update(integer=OPERATIONS.get_expression(fields['integer'], 'add')('integer', 10),
+                  logic=OPERATIONS.get_expression(fields['logic'], 'swap')('logic'),
+                  nullable=OPERATIONS.get_expression(fields['nullable'], 'set null')('nullable'))
+        updated = qs.get()
+        self.assertEqual(updated.integer, record.integer + 10)
+        self.assertEqual(updated.logic, not record.logic)
+        self.assertIsNone(updated.nullable)
+        self.assertIsNone(OPERATIONS.get_expression(fields['char'], 'capitalize'))
+        # python and the databases do not strip the same characters or round the same way
+        self.assertIsNone(OPERATIONS.get_expression(fields['char'], 'trim'))
+        self.assertIsNone(OPERATIONS.get_expression(fields['integer'], 'add percent'))
+        self.assertIsNone(OPERATIONS.get_expression(fields['integer'], 'sub percent'))
+
+    def test_bulk(self):
+        with user_grant_permission(self.user, ['demo.change_demomodel', 'demo.adminactions_massupdate_demomodel']):
+            with mock.patch.object(DemoModel, 'save', side_effect=AssertionError):
+                res = self._run_action(**{'_validate': 1, '_bulk': 1}).follow()
+            messages = [m.message for m in list(res.context['messages'])]
+            self.assertEqual('Updated 2 records', messages[0])
+        assert DemoModel.objects.filter(char='BBB').exists()
+        assert not DemoModel.objects.filter(char='bbb').exists()
+
     def test_clean_on(self):
         self._run_action(**{'_clean': 1})
         assert DemoModel.objects.filter(char='BBB').exists()
@@ -82,3 +117,20 @@ class MassUpdateTest(SelectRowsMixin, CheckSignalsMixin, WebTestMixin, Transacti
             messages = [m.message for m in list(res.context['messages'])]
             self.assertTrue(messages)
             self.assertEqual('Updated 1 records', messages[0])
+
+    def test_sample(self):
+        with self.settings(ADMINACTIONS_MASS_UPDATE_SAMPLE_SIZE=1):
+            res = self._run_action(steps=1)
+        grouped = res.context['grouped']
+        self.assertEqual(len(grouped['char']), 1)
+        self.assertEqual(grouped['choices'], ['Choice 1', 'Choice 2', 'Choice 3'])
+        self.assertEqual(grouped['logic'], [True, False])
+
+    def test_sample_foreignkey(self):
+        G(UserDetail, user=self.user, note='a')
+        G(UserDetail, user=self.user, note='a')
+        fields = UserDetail._meta.fields
+        with self.assertNumQueries(2):
+            grouped = get_sample_values(UserDetail.objects.all(), fields, 10)
+        self.assertEqual(grouped['user'], [six.text_type(self.user)])
+        self.assertEqual(grouped['note'], ['a'])
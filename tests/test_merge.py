@@ -1,5 +1,6 @@
 # -*- coding: utf-8 -*-
 from __future__ import absolute_import
+import datetime
 from django.conf import settings
 from django.contrib.admin.models import LogEntry
 from django.contrib.auth.models import User, Group, Permission
@@ -7,13 +8,14 @@ from django.core.urlresolvers import reverse
 from django.test import TransactionTestCase
 from django_dynamic_fixture import G
 from django_webtest import WebTestMixin
+import mock
 import six
-from adminactions.api import merge, ALL_FIELDS
+from adminactions.api import merge, merge_many, ALL_FIELDS
 
 from demo.common import BaseTestCaseMixin
 from demo.utils import SelectRowsMixin
 from demo.utils import user_grant_permission
-from demo.models import UserDetail
+from demo.models import UserDetail, UserProfile
 from six.moves import range
 
 PROFILE_MODULE = getattr(settings, 'AUTH_PROFILE_MODULE', 'tests.UserProfile')
@@ -110,6 +112,49 @@ class MergeTestApi(BaseTestCaseMixin, TransactionTestCase):
         self.assertSequenceEqual(master.logentry_set.all(), [entry])
         self.assertTrue(LogEntry.objects.filter(pk=entry.pk).exists())
 
+    def test_merge_related_bulk(self):
+        master = User.objects.get(pk=self.master_pk)
+        other = User.objects.get(pk=self.other_pk)
+        entries = [other.logentry_set.create(object_repr='test%s' % i, action_flag=1) for i in range(10)]
+        groups = [Group.objects.get_or_create(name='G%s' % i)[0] for i in range(5)]
+        other.groups.add(*groups)
+
+        with mock.patch.object(LogEntry, 'save', side_effect=AssertionError):
+            merge(master, other, commit=True, related=ALL_FIELDS, m2m=ALL_FIELDS)
+
+        self.assertEqual(sorted(master.logentry_set.values_list('pk', flat=True)), sorted(e.pk for e in entries))
+        self.assertEqual(sorted(master.groups.values_list('pk', flat=True)), sorted(g.pk for g in groups))
+
+    def test_merge_many(self):
+        master, others = User.objects.get(pk=2), list(User.objects.filter(pk__in=[3, 4, 5]))
+        group = Group.objects.get_or_create(name='G1')[0]
+        for other in others:
+            other.groups.add(group)
+            other.logentry_set.create(object_repr='test', action_flag=1)
+
+        result = merge_many(master, others, fields=['first_name'], commit=True,
+                            related=ALL_FIELDS, m2m=ALL_FIELDS)
+
+        self.assertEqual(User.objects.get(pk=result.pk).first_name, others[0].first_name)
+        self.assertFalse(User.objects.filter(pk__in=[3, 4, 5]).exists())
+        self.assertEqual(master.logentry_set.count(), 3)
+        self.assertSequenceEqual(master.groups.all(), [group])
+
+    def test_merge_many_one_to_one(self):
+        master, others = User.objects.get(pk=2), list(User.objects.filter(pk__in=[3, 4]))
+        profile = G(UserProfile, user=others[1])
+
+        merge_many(master, others, commit=True, related=ALL_FIELDS)
+        self.assertEqual(UserProfile.objects.get(pk=profile.pk).user_id, master.pk)
+
+        # only one profile can be moved to master
+        others = [G(User), G(User)]
+        for other in others:
+            G(UserProfile, user=other)
+        with self.assertRaisesRegexp(ValueError, "3 records of UserProfile"):
+            merge_many(master, others, commit=True, related=ALL_FIELDS)
+        self.assertEqual(User.objects.filter(pk__in=[o.pk for o in others]).count(), 2)
+
     # @skipIf(not hasattr(settings, 'AUTH_PROFILE_MODULE'), "")
     def test_merge_one_to_one_field(self):
         master = User.objects.get(pk=self.master_pk)
@@ -203,15 +248,38 @@ class TestMergeAction(SelectRowsMixin, WebTestMixin, TransactionTestCase):
         self.assertEqual(preserved_after.email, removed.email)
         self.assertFalse(LogEntry.objects.filter(pk=removed.pk).exists())
 
-    def test_error_if_too_many_records(self):
+    def test_error_if_too_few_records(self):
         with user_grant_permission(self.user, ['auth.change_user', 'auth.adminactions_merge_user']):
             res = self.app.get('/', user='user')
             res = res.click('Users')
             form = res.forms['changelist-form']
             form['action'] = 'merge'
-            self._select_rows(form, [1, 2, 3])
+            self._select_rows(form, [1])
             res = form.submit().follow()
-            self.assertContains(res, 'Please select exactly 2 records')
+            self.assertContains(res, 'Please select at least 2 records')
+
+    def test_merge_many(self):
+        with user_grant_permission(self.user, ['auth.change_user', 'auth.adminactions_merge_user']):
+            res = self.app.get('/', user='user')
+            res = res.click('Users')
+            form = res.forms['changelist-form']
+            form['action'] = 'merge'
+            self._select_rows(form, [1, 2, 3, 4])
+            res = form.submit()
+            master, other, extra = self._selected_values[0], self._selected_values[1], self._selected_values[2:]
+            for pk in [other] + extra:
+                User.objects.get(pk=pk).logentry_set.create(object_repr='test', action_flag=1)
+
+            res.form['username'] = res.form['form-1-username'].value
+            res.form['email'] = res.form['form-1-email'].value
+            res.form['last_login'] = res.form['form-1-last_login'].value
+            res.form['date_joined'] = res.form['form-1-date_joined'].value
+            res = res.form.submit('preview')
+            res = res.form.submit('apply')
+
+            self.assertTrue(User.objects.filter(pk=master).exists())
+            self.assertFalse(User.objects.filter(pk__in=[other] + extra).exists())
+            self.assertEqual(LogEntry.objects.filter(user__pk=master, object_repr='test').count(), 3)
 
     def test_swap(self):
         with user_grant_permission(self.user, ['auth.change_user', 'auth.adminactions_merge_user']):
@@ -249,6 +317,58 @@ class TestMergeAction(SelectRowsMixin, WebTestMixin, TransactionTestCase):
             self.assertEqual(preserved_after.email, removed.email)
             self.assertFalse(LogEntry.objects.filter(pk=removed.pk).exists())
 
+    def test_preview_unique(self):
+        with user_grant_permission(self.user, ['auth.change_user', 'auth.adminactions_merge_user']):
+            res = self.app.get('/', user='user')
+            res = res.click('Users')
+            form = res.forms['changelist-form']
+            form['action'] = 'merge'
+            self._select_rows(form, [1, 2])
+            res = form.submit()
+            res.form['last_login'] = res.form['form-1-last_login'].value
+            res.form['date_joined'] = res.form['form-1-date_joined'].value
+
+            # the username of a merged record can be used
+            res.form['username'] = res.form['form-1-username'].value
+            with mock.patch.object(User, 'delete') as delete:
+                preview = res.form.submit('preview')
+            self.assertFalse(delete.called)
+            self.assertEqual(preview.templates[0].name, 'adminactions/merge_preview.html')
+
+            # ... others not
+            G(User, username='taken')
+            res.form['username'] = 'taken'
+            res = res.form.submit('preview')
+            self.assertEqual(res.templates[0].name, 'adminactions/merge.html')
+            self.assertIn('username', res.context['adminform'].form.errors)
+            self.assertEqual(res.context['master'].username, User.objects.get(pk=self._selected_values[0]).username)
+
+    def test_validate_unique_for_date(self):
+        from django.forms.models import modelform_factory
+        from django.forms.utils import ErrorDict
+        from django.utils.timezone import utc
+        from adminactions.merge import MergeForm
+
+        master, other = User.objects.exclude(pk=self.user.pk).order_by('pk')[:2]
+        # noon in UTC and in TIME_ZONE
+        other.date_joined = master.date_joined = datetime.datetime(2014, 1, 1, 5, tzinfo=utc)
+        other.save()
+        master.username = other.username
+        MForm = modelform_factory(User, form=MergeForm, exclude=('pk', ))
+        date_checks = [(User, 'date', 'username', 'date_joined')]
+        with mock.patch.object(User, '_get_unique_checks', return_value=([], date_checks)):
+            form = MForm(instance=master)
+            form.cleaned_data = {'other_pk': other.pk, 'extra_pks': []}
+            form._errors = ErrorDict()
+            # the merged records do not conflict
+            form.validate_unique()
+            self.assertFalse(form._errors)
+
+            G(User, username='taken', date_joined=master.date_joined)
+            master.username = 'taken'
+            form.validate_unique()
+            self.assertIn('username', form._errors)
+
     def test_merge_move_detail(self):
         from adminactions.merge import MergeForm
 
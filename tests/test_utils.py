@@ -29,3 +29,129 @@ def test_flatten():
     from adminactions.utils import flatten
 
     assert flatten([[[1, 2, 3], (42, None)], [4, 5], [6], 7, (8, 9, 10)]) == [1, 2, 3, 42, None, 4, 5, 6, 7, 8, 9, 10]
+
+
+def test_get_field_accessors():
+    from collections import namedtuple
+    from django.contrib.auth.models import Permission
+    from django.contrib.contenttypes.models import ContentType
+    from adminactions.utils import get_field_accessors, get_field_value
+    from demo.models import DemoModel
+
+    ct = ContentType(app_label='auth', model='user')
+    p = Permission(name='perm', codename='code', content_type=ct)
+    fields = ['name', 'content_type', 'content_type.app_label', 'natural_key']
+    accessors = get_field_accessors(p, fields)
+    assert [a(p) for a in accessors] == [get_field_value(p, f) for f in fields]
+    assert get_field_accessors(p, fields) is accessors
+
+    d = DemoModel(choices=2)
+    assert get_field_accessors(d, ['choices'])[0](d) == 'Choice 2'
+    assert get_field_accessors(d, ['choices'], usedisplay=False)[0](d) == 2
+
+    row = {'codename': 'add_user', 'content_type__app_label': 'auth'}
+    assert [a(row) for a in get_field_accessors(row, list(row.keys()))] == list(row.values())
+
+    Row = namedtuple('Row', 'field1,field2')
+    row = Row(1, 'a')
+    assert [a(row) for a in get_field_accessors(row, ['field1', 'field2'])] == [1, 'a']
+
+
+@pytest.mark.django_db
+def test_iter_queryset():
+    from django.contrib.auth.models import Permission
+    from adminactions.utils import iter_queryset
+
+    qs = Permission.objects.all()
+    expected = list(qs.order_by('pk').values_list('pk', flat=True))
+    assert [p.pk for p in iter_queryset(qs.order_by('pk'))] == expected
+    # keyset pagination
+    assert [p.pk for p in iter_queryset(qs.order_by('pk'), 7)] == expected
+    assert [pk for pk, in iter_queryset(qs.order_by().values_list('pk'), len(expected))] == expected
+    # LIMIT/OFFSET
+    expected = list(qs.order_by('codename', 'pk').values_list('pk', flat=True))
+    assert [p.pk for p in iter_queryset(qs.order_by('codename'), 7)] == expected
+    assert [p.pk for p in iter_queryset(qs.order_by('codename')[:10], 3)] == expected[:10]
+    assert list(iter_queryset([1, 2, 3], 2)) == [1, 2, 3]
+
+
+@pytest.mark.django_db
+def test_export_chunk_size(settings):
+    from django.contrib.auth.models import Permission
+    from adminactions.api import export_as_csv
+
+    settings.ADMINACTIONS_EXPORT_CHUNK_SIZE = 5
+    qs = Permission.objects.order_by('pk')
+    response = export_as_csv(qs, fields=['codename'])
+    assert len(response.content.splitlines()) == qs.count()
+
+
+@pytest.mark.django_db
+def test_iter_server_side():
+    import sys
+    import mock
+    from django.db import connection
+    from django.db.backends.sqlite3.base import SQLiteCursorWrapper
+    from django.contrib.auth.models import Permission
+    from adminactions.utils import iter_queryset
+
+    # a sqlite cursor plays the PostgreSQL named one
+    declared = []
+    sizes = []
+
+    class NamedCursor(object):
+        def __init__(self, cursor):
+            self.cursor = cursor
+
+        def fetchmany(self, size):
+            sizes.append(size)
+            return self.cursor.fetchmany(size)
+
+        def __getattr__(self, name):
+            return getattr(self.cursor, name)
+
+    class Connection(object):
+        def __init__(self, connection):
+            self.connection = connection
+
+        def cursor(self, name=None, withhold=False, **kwargs):
+            if name is None:
+                return self.connection.cursor(**kwargs)
+            declared.append((name, withhold))
+            return NamedCursor(self.connection.cursor(factory=SQLiteCursorWrapper))
+
+    qs = Permission.objects.filter(pk__gt=0).order_by('pk')
+    expected = list(qs.values_list('pk', flat=True))
+    connection.ensure_connection()
+    backend = mock.Mock(utc_tzinfo_factory=None)
+    with mock.patch.dict(sys.modules, {'django.db.backends.postgresql_psycopg2.base': backend}):
+        with mock.patch.object(connection, 'vendor', 'postgresql'):
+            with mock.patch.object(connection, 'connection', Connection(connection.connection)):
+                assert [p.pk for p in iter_queryset(qs, fetch_size=7)] == expected
+                assert len(declared) == 1
+                # a later query uses the default cursor
+                assert Permission.objects.count() == len(expected)
+    assert len(declared) == 1
+    # inside a transaction WITH HOLD is not needed
+    assert declared[0][1] is False
+    assert set(sizes) == set([7])
+    assert 'create_cursor' not in connection.__dict__
+
+
+@pytest.mark.django_db
+def test_iter_queryset_keyset():
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+    from django.contrib.auth.models import Permission
+    from adminactions.utils import iter_queryset
+
+    # the admin changelist always adds '-pk' to the ordering
+    for ordering in (['-pk'], ['codename', '-pk'], ['-codename']):
+        qs = Permission.objects.order_by(*ordering)
+        expected = list(qs.order_by(*(ordering + ['pk'])).values_list('pk', flat=True))
+        with CaptureQueriesContext(connection) as ctx:
+            assert [p.pk for p in iter_queryset(qs, 7)] == expected
+            assert [pk for pk, in iter_queryset(qs.values_list('pk'), 7)] == expected
+        # no query reads more than a chunk
+        offsets = [q['sql'] for q in ctx.captured_queries if 'OFFSET' in q['sql']]
+        assert not [sql for sql in offsets if 'LIMIT 1 OFFSET 6' not in sql]